@@ -0,0 +1,89 @@
+"""Module for a pool of persistent read-only connections to the database."""
+
+import queue
+
+from contextlib import closing, contextmanager
+from pathlib import Path
+from sqlite3 import connect
+
+
+# pragmas applied to every pooled connection
+DEFAULT_PRAGMAS = {
+    "query_only": 1,
+    "mmap_size": 256 * 1024 * 1024,
+    # negative values are in KiB
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# number of prepared statements each connection keeps compiled
+CACHED_STATEMENTS = 256
+
+
+def connect_readonly(db_file, pragmas=None):
+    """Opens a read-only connection to the database that can be handed between threads.
+
+    Args:
+        db_file (str): database file
+        pragmas (dict): pragmas to apply, DEFAULT_PRAGMAS if not given
+
+    Return:
+        sqlite3.Connection: connection opened with the mode=ro URI
+    """
+
+    db_uri = Path(db_file).resolve().as_uri() + "?mode=ro"
+    connection = connect(db_uri, isolation_level=None, uri=True, check_same_thread=False,
+                         cached_statements=CACHED_STATEMENTS)
+
+    with closing(connection.cursor()) as cursor:
+        for pragma, value in (DEFAULT_PRAGMAS if pragmas is None else pragmas).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        # parse the schema now rather than on the first request
+        cursor.execute("SELECT count(*) FROM sqlite_schema").fetchall()
+
+    return connection
+
+
+class ConnectionPool():
+    """Class that keeps a fixed number of read-only connections open for its whole lifetime.
+    Connections are borrowed for one query at a time with connection().
+    """
+
+    def __init__(self, db_file, size, pragmas=None):
+        """Opens all the connections of the pool up front.
+
+        Args:
+            db_file (str): database file
+            size (int): number of connections
+            pragmas (dict): pragmas to apply to each connection
+        """
+
+        self._db_file = db_file
+        self._connections = [connect_readonly(db_file, pragmas) for _ in range(size)]
+        self._idle = queue.LifoQueue()
+        for connection in self._connections:
+            self._idle.put(connection)
+
+    @property
+    def db_file(self):
+        """The database file the pool is connected to."""
+
+        return self._db_file
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection from the pool, waiting for one to be returned if all of them
+        are in use, and gives it back once the with block is done.
+        """
+
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        """Closes every connection of the pool."""
+
+        for connection in self._connections:
+            connection.close()
@@ -5,15 +5,37 @@ from json import JSONDecodeError
 import argparse
 import sys
 
+from collections import OrderedDict
 
-from socket import socket
-from PySide6.QtWidgets import QApplication, QFrame, QLabel, QListWidget
+
+from PySide6.QtWidgets import QApplication, QFrame, QLabel, QListView
 from PySide6.QtWidgets import QMainWindow, QGridLayout, QPushButton, QLineEdit
-from PySide6.QtWidgets import QListWidgetItem, QErrorMessage
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QErrorMessage, QProgressBar
+from PySide6.QtCore import Qt, QPoint, QThreadPool, QTimer
 
 from dialog import FW_FONT, FixedWidthMessageDialog
+from prefix_cache import PrefixCache
+from search_model import SearchResultsModel
+from server_session import ServerSession
+from server_worker import ServerWorker
 from table import Table
+import wire_format
+
+# rows per page of search results, the next page is fetched when the list is scrolled to the end
+SEARCH_PAGE_SIZE = 1000
+
+# incremental search: milliseconds without typing before the search starts, and the
+# searches kept to answer refined searches locally
+SEARCH_DEBOUNCE_MS = 300
+PREFIX_CACHE_ENTRIES = 32
+PREFIX_CACHE_TTL = 60
+
+# details of the rows on screen (and a few more) are fetched in one batch once scrolling
+# stops for a moment, so that opening them needs no round trip
+PREFETCH_DELAY_MS = 150
+PREFETCH_MARGIN = 10
+MAX_PREFETCH = 100
+DETAILS_CACHE_ENTRIES = 1000
 
 
 class InvalidPortError(Exception):
@@ -31,7 +53,8 @@ class SearchingError(Exception):
 class LuxGUI():
     """A GUI class for Lux."""
 
-    def __init__(self, server_host, server_port, platform_os):
+    def __init__(self, server_host, server_port, platform_os, incremental=True,
+                 compact=False):
         """Initalizes the GUI with the given host and port
         and creates the neccessary widgets and frame for the GUI.
 
@@ -39,11 +62,17 @@ class LuxGUI():
             host (str): host to connect to
             port (int): port to connect to
             platform_os (str): OS of user
+            incremental (bool): search as the user types
+            compact (bool): ask for search results in the compressed columnar encoding
         """
 
         self._host = server_host
         self._port = server_port
         self._platform_os = platform_os
+        self._compact = compact
+
+        # requests share keep-alive connections to the server
+        self._session = ServerSession(server_host, server_port)
 
         self.app = QApplication(sys.argv)
         self.label = QLineEdit()
@@ -59,16 +88,58 @@ class LuxGUI():
         # store selected id
         self._selected_id = None
 
-        # self.search_results is a dictionary from json.loads()
-        self.search_results = None
-        self.list_widget = QListWidget()
-        self.list_widget.setFont(FW_FONT)
-
-        # When list widget item is clicked, display dialog
-        self.list_widget.itemDoubleClicked.connect(self.callback_list_item)
-
-        # install event filter for pressing enter in list widget item
-        self.list_widget.keyPressEvent = self.callback_list_item_enter
+        # self.search_results holds the rows of the current search, the list view only
+        # formats the rows it shows
+        self.search_results = SearchResultsModel()
+        self.list_view = QListView()
+        self.list_view.setFont(FW_FONT)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.search_results)
+
+        # paging state of the current search: the request and the cursor of the next page
+        # (None after the last page)
+        self._search_request = None
+        self._next_cursor = None
+        self.list_view.verticalScrollBar().valueChanged.connect(self.callback_scroll)
+
+        # requests to the server run on the thread pool; a new search or details request
+        # supersedes the one of its kind in flight, whose results are dropped
+        self._thread_pool = QThreadPool.globalInstance()
+        self._request_count = 0
+        self._search_worker = None
+        self._details_worker = None
+        self._prefetch_worker = None
+        # pending requests, each mapped to whether it runs in the background
+        self._busy_requests = {}
+        self.busy_indicator = QProgressBar()
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.hide()
+
+        # incremental search: typing restarts the timer, the search starts when it runs out;
+        # complete results of earlier searches answer the searches that refine them
+        self._prefix_cache = PrefixCache(PREFIX_CACHE_ENTRIES, PREFIX_CACHE_TTL)
+        self._first_page = None
+        self._search_timer = QTimer()
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self._search_timer.timeout.connect(self.callback_search)
+        if incremental:
+            for line_edit in (self.label, self.classifier, self.agent, self.department):
+                line_edit.textEdited.connect(lambda _: self._search_timer.start())
+
+        # details by object id, of the objects opened or prefetched lately
+        self._details_cache = OrderedDict()
+        self._prefetch_timer = QTimer()
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(PREFETCH_DELAY_MS)
+        self._prefetch_timer.timeout.connect(self.prefetch_details)
+
+        # When list view item is clicked, display dialog
+        self.list_view.doubleClicked.connect(self.callback_list_item)
+
+        # install event filter for pressing enter in list view item
+        self.list_view.keyPressEvent = self.callback_list_item_enter
 
         # Set layout on frame
         self.frame.setLayout(self.layout)
@@ -97,6 +168,7 @@ class LuxGUI():
         search_button = QPushButton("Search")
         self.layout.addWidget(search_button, 4, 1)
         search_button.clicked.connect(self.callback_search)
+        self.layout.addWidget(self.busy_indicator, 5, 1)
 
         # Sizing the screen
         screen_size = self.app.primaryScreen().availableGeometry()
@@ -104,38 +176,103 @@ class LuxGUI():
         self.window.resize(screen_size.width()//2, screen_size.height()//2)
 
         # List of responses we get back
-        self.layout.addWidget(self.list_widget, 8, 0)
+        self.layout.addWidget(self.list_view, 8, 0)
 
         # self.original_keyPressEvent = self.window.keyPressEvent
         # set key press event
         self.window.keyPressEvent = self.on_enter
 
-        self.layout.addWidget(self.list_widget, 8, 0)
+        self.layout.addWidget(self.list_view, 8, 0)
 
         self.window.show()
         sys.exit(self.app.exec())
 
+    def start_request(self, fetch, on_result, superseded=None, background=False):
+        """Runs a request to the server on the thread pool and shows the busy indicator
+        until it finishes. on_result gets each result on the UI thread; errors are shown
+        in the error message.
+
+        Args:
+            fetch (callable): function without arguments that talks to the server and returns
+                an iterable of results
+            on_result (callable): callback for each result
+            superseded (ServerWorker): worker of the request this one replaces, cancelled
+            background (bool): neither show the busy indicator nor the errors of the request
+
+        Return:
+            ServerWorker: worker of the request
+        """
+
+        if superseded is not None:
+            superseded.cancel()
+            self.request_finished(superseded.request_id)
+
+        self._request_count += 1
+        worker = ServerWorker(self._request_count, fetch)
+
+        def deliver(request_id, result):
+            # drop the results of a superseded request
+            if request_id in self._busy_requests:
+                on_result(result)
+
+        worker.signals.result.connect(deliver)
+        worker.signals.error.connect(self.request_failed)
+        worker.signals.finished.connect(self.request_finished)
+
+        self._busy_requests[worker.request_id] = background
+        if not background:
+            self.busy_indicator.show()
+        self._thread_pool.start(worker)
+        return worker
+
+    def request_failed(self, request_id, err):
+        """Shows the error of a request in the error message, unless it was superseded
+        or runs in the background.
+
+        Args:
+            request_id (int): id of the request
+            err (Exception): error of the request
+        """
+
+        if self._busy_requests.get(request_id, True):
+            return
+        if isinstance(err, SearchingError):
+            self.error_message.showMessage(str(err.err))
+        else:
+            self.error_message.showMessage(str(err))
+
+    def request_finished(self, request_id):
+        """Marks a request as done and hides the busy indicator once only requests in the
+        background are left.
+
+        Args:
+            request_id (int): id of the request
+        """
+
+        self._busy_requests.pop(request_id, None)
+        if all(self._busy_requests.values()):
+            self.busy_indicator.hide()
+
     def connect_to_server(self, data):
-        """Connect lux to server and fetch the data sent from the server.
+        """Send a request to the server on a keep-alive connection and fetch the data
+        sent from the server.
 
         Args:
             data (dict): user inputted arguments as a dictionary
 
         Return:
-            json str
+            dict: response of the server
         """
 
-        with socket() as sock:
-            sock.connect((self._host, self._port))
-
+        with self._session.connection() as conn:
             # write to the server
-            out_flo = sock.makefile(mode='w', encoding='utf-8')
-            out_flo.write(data + "\n")
-            out_flo.flush()
+            conn.send(data)
 
             # read from the server
-            in_flo = sock.makefile(mode='r', encoding='utf-8')
-            response = in_flo.readline()
+            response = conn.readline()
+            if response == '':
+                raise SearchingError("The server has crashed")
+            conn.finish()
 
         try:
             response = json.loads(response)
@@ -144,6 +281,44 @@ class LuxGUI():
 
         return response
 
+    def stream_from_server(self, data):
+        """Send a request to the server on a keep-alive connection and yield the frames of
+        a streamed response as they arrive. A server that does not stream answers with
+        a single frame holding the whole response.
+
+        Args:
+            data (dict): user inputted arguments as a dictionary, with stream set
+
+        Return:
+            generator of dict: header, rows and trailer frames
+        """
+
+        with self._session.connection() as conn:
+            # write to the server
+            conn.send(data)
+
+            # read the frames from the server
+            while (line := conn.readline()) != '':
+                try:
+                    frame = wire_format.decode(json.loads(line))
+                except JSONDecodeError as json_error:
+                    conn.finish()
+                    raise SearchingError(line) from json_error
+
+                if frame.get("frame") == "error":
+                    conn.finish()
+                    raise SearchingError(frame["message"])
+
+                # the connection can take the next request once the last frame is read
+                if frame.get("frame") in (None, "trailer"):
+                    conn.finish()
+                    yield frame
+                    return
+
+                yield frame
+
+        raise SearchingError("The server has crashed")
+
     def parse_label_data(self, line_edit_object):
         """Function used to fetch text data from QLineEdit object.
         If empty string, replace with None to use in query.
@@ -172,38 +347,112 @@ class LuxGUI():
         data_agent = self.parse_label_data(self.agent)
         data_department = self.parse_label_data(self.department)
         data_dict = {"id": None, "label": data_label, "classifier": data_classifier,
-                     "agt": data_agent, "dep": data_department}
-
-        # Connect to the server and get back the results
-        try:
-            self.search_results = self.connect_to_server(json.dumps(data_dict))
-        except SearchingError as err:
-            self.error_message.showMessage(str(err.err))
-            return
-        except Exception as err:
-            self.error_message.showMessage(str(err))
+                     "agt": data_agent, "dep": data_department, "stream": True,
+                     "page_size": SEARCH_PAGE_SIZE}
+        if self._compact:
+            data_dict.update(encoding="columnar", compression="zlib")
+        self._search_timer.stop()
+
+        # the same search is still on its way
+        if data_dict == self._search_request and self._search_worker is not None\
+                and self._search_worker.request_id in self._busy_requests:
             return
 
-        # Error Handling for when search result is not present (TODO)
-        if not self.search_results:
-            self.error_message.showMessage(
-                "The server has crashed")
+        self._search_request = data_dict
+        self._next_cursor = None
+
+        # a refinement of a complete earlier search is answered without the server
+        cached = self._prefix_cache.get(data_dict)
+        if cached is not None:
+            if self._search_worker is not None:
+                self._search_worker.cancel()
+                self.request_finished(self._search_worker.request_id)
+            self.search_results.reset(cached[0])
+            self.search_results.append_rows(cached[1])
+            self._prefetch_timer.start()
             return
 
-        # Now show the search results
-        # Refresh list widgets, in case we had previous search
-        self.list_widget.clear()
-        # switch order of nationalities and timespan
-        search_table = Table(self.search_results["columns"], self.search_results["data"],
-                             max_width=float('inf'), format_str=['w', 'w', 'w', 'w', 'w'])
+        # Refresh the list, in case we had previous search
+        self.search_results.clear()
+        self.fetch_search_page()
+
+    def callback_scroll(self, value):
+        """Callback function that executes when the list widget is scrolled.
+        Fetches the next page of the search results once the end of the list is reached,
+        and the details of the rows on screen once scrolling stops.
+
+        Args:
+            value (int): position of the vertical scroll bar
+        """
+
+        self._prefetch_timer.start()
+
+        if (self._next_cursor is not None
+                and self._search_worker.request_id not in self._busy_requests
+                and value >= self.list_view.verticalScrollBar().maximum()):
+            self.fetch_search_page(self._next_cursor)
+
+    def fetch_search_page(self, page_cursor=None):
+        """Connect to the server for a page of the current search in the background and show
+        its rows batch by batch as they arrive, after the rows of the previous pages.
+        The page replaces any search request still in flight.
+
+        Args:
+            page_cursor (str): next_cursor of the previous page, None for the first page
+        """
+
+        request = dict(self._search_request, cursor=page_cursor)
+        self._next_cursor = None
 
-        for index, row in enumerate(search_table):
-            item = QListWidgetItem(''.join(row))
-            item.setData(Qt.UserRole, self.search_results["data"][index][0])
-            self.list_widget.addItem(item)
+        self._search_worker = self.start_request(
+            lambda: self.stream_from_server(request),
+            lambda frame: self.show_search_frame(frame, page_cursor is None),
+            superseded=self._search_worker)
+
+    def show_search_frame(self, frame, first_page):
+        """Shows a frame of the search response.
+
+        Args:
+            frame (dict): header, rows or trailer frame, or the whole response
+            first_page (bool): whether the frame belongs to the first page of the search
+        """
+
+        if frame.get("frame") == "header":
+            if first_page:
+                self.search_results.reset(frame["columns"])
+                self._first_page = (frame["columns"], [])
+            return
+        if frame.get("frame") == "trailer":
+            self._next_cursor = frame.get("next_cursor")
+            if first_page:
+                self.cache_first_page()
+            return
+        if frame.get("frame") is None:
+            # the server answered with the whole response at once
+            if first_page:
+                self.search_results.reset(frame["columns"])
+                self._first_page = (frame["columns"], [])
+            self._next_cursor = frame.get("next_cursor")
+
+        self.search_results.append_rows(frame["data"])
+        self._prefetch_timer.start()
+        if first_page:
+            self._first_page[1].extend(frame["data"])
+            if frame.get("frame") is None:
+                self.cache_first_page()
+
+    def cache_first_page(self):
+        """Keeps the rows of the current search for the searches that refine it,
+        if the first page holds all of them.
+        """
+
+        columns, rows = self._first_page
+        self._first_page = None
+        if self._next_cursor is None and len(rows) < SEARCH_PAGE_SIZE:
+            self._prefix_cache.put(self._search_request, columns, rows)
 
     def callback_list_item_enter(self, event):
-        """Callback function for the list widget item that checks if the key press is enter 
+        """Callback function for the list view item that checks if the key press is enter 
         (command + O for Mac). 
         if so, it will treat it as if the item is double clicked.
         If the event is not enter, then it will treat the key press as normal.
@@ -216,39 +465,102 @@ class LuxGUI():
         if (event.modifiers() == Qt.ControlModifier and event.key() == Qt.Key_O
                 and self._platform_os == "OS X"):
             try:
-                self.callback_list_item(self.list_widget.selectedItems()[0])
+                self.callback_list_item(self.list_view.selectedIndexes()[0])
             except IndexError:
                 self.error_message.showMessage("Please select a field!")
         elif event.key() in [Qt.Key.Key_Return, Qt.Key_Enter]:
             try:
-                self.callback_list_item(self.list_widget.selectedItems()[0])
+                self.callback_list_item(self.list_view.selectedIndexes()[0])
             except IndexError:
                 self.error_message.showMessage("Please select a field!")
         else:
-            super(QListWidget, self.list_widget).keyPressEvent(event)
+            QListView.keyPressEvent(self.list_view, event)
 
     def callback_list_item(self, item):
         """Callback function for when list item is double clicked, 
         display dialog with the object's information.
 
         Args:
-            item: list object
+            item (QModelIndex): index of the list item
         """
 
         selected_id = item.data(Qt.UserRole)
 
-        data_dict = {"id": selected_id}
+        # prefetched details open at once
+        dialog_data = self._details_cache.get(str(selected_id))
+        if dialog_data is not None:
+            self._details_cache.move_to_end(str(selected_id))
+            self.show_dialog(selected_id, dialog_data)
+            return
 
-        # dialog_data is a dictionary
-        try:
-            dialog_data = self.connect_to_server(json.dumps(data_dict))
-        except SearchingError as err:
-            self.error_message.showMessage(str(err.err))
+        data = {"id": selected_id}
+
+        # the dialog is shown once the server answers
+        self._details_worker = self.start_request(
+            lambda: [self.connect_to_server(data)],
+            lambda dialog_data: self.show_details(selected_id, dialog_data),
+            superseded=self._details_worker)
+
+    def show_details(self, selected_id, dialog_data):
+        """Caches the details of an object and displays them in a dialog.
+
+        Args:
+            selected_id: id of the object
+            dialog_data (dict): response of the server for the object
+        """
+
+        self.cache_details({"details": {str(selected_id): dialog_data}})
+        self.show_dialog(selected_id, dialog_data)
+
+    def prefetch_details(self):
+        """Fetches the details of the rows on screen that are not cached yet in one batch
+        request in the background, replacing a prefetch still in flight.
+        """
+
+        row_count = self.search_results.rowCount()
+        if not row_count:
             return
-        except Exception as err_message:
-            self.error_message.showMessage(str(err_message))
+
+        viewport = self.list_view.viewport()
+        first_row = self.list_view.indexAt(QPoint(0, 0)).row()
+        last_row = self.list_view.indexAt(QPoint(0, viewport.height() - 1)).row()
+        first_row = max(first_row, 0)
+        last_row = row_count - 1 if last_row < 0 else last_row
+
+        obj_ids = [self.search_results.object_id(row) for row in
+                   range(first_row, min(last_row + PREFETCH_MARGIN, row_count - 1) + 1)]
+        obj_ids = [obj_id for obj_id in obj_ids
+                   if str(obj_id) not in self._details_cache][:MAX_PREFETCH]
+        if not obj_ids:
             return
 
+        data = {"ids": obj_ids}
+        self._prefetch_worker = self.start_request(
+            lambda: [self.connect_to_server(data)], self.cache_details,
+            superseded=self._prefetch_worker, background=True)
+
+    def cache_details(self, response):
+        """Keeps the details of a batch response, evicting the least recently used ones.
+
+        Args:
+            response (dict): response of the server to a batch request
+        """
+
+        for obj_id, dialog_data in response["details"].items():
+            if dialog_data is not None:
+                self._details_cache[obj_id] = dialog_data
+                self._details_cache.move_to_end(obj_id)
+        while len(self._details_cache) > DETAILS_CACHE_ENTRIES:
+            self._details_cache.popitem(last=False)
+
+    def show_dialog(self, selected_id, dialog_data):
+        """Display dialog with the object's information.
+
+        Args:
+            selected_id: id of the object
+            dialog_data (dict): response of the server for the object
+        """
+
         dialog_data_obj_dict = dialog_data['object']
         dialog_data_agt_dict = dialog_data['agents']
 
@@ -324,6 +636,14 @@ if __name__ == '__main__':
     parser.add_argument(
         "port", help="the port at which the server is listening")
 
+    parser.add_argument(
+        "--no-incremental", action="store_true",
+        help="search only on the Search button or Enter, not as you type")
+
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="receive search results column by column and compressed, for slow links")
+
     args = parser.parse_args()
 
     host = args.host
@@ -340,6 +660,7 @@ if __name__ == '__main__':
 
     # initalizes the GUI
     try:
-        LuxGUI(host, port, platforms[sys.platform])
+        LuxGUI(host, port, platforms[sys.platform], incremental=not args.no_incremental,
+               compact=args.compact)
     except Exception as err_mess:
         print(f"The GUI has crashed: {err_mess}", file=sys.stderr)
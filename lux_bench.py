@@ -0,0 +1,469 @@
+"""Module for load testing the server: simulated clients send a mix of searches and details
+requests over the keep-alive protocol of the GUI, and the throughput, latency percentiles and
+error rates of the run are reported and saved as json, to compare runs across commits.
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from contextlib import closing
+from datetime import datetime
+from json import JSONDecodeError
+from sqlite3 import connect, Error
+
+from server_session import ServerSession
+
+# kinds of requests a simulated client sends, as the GUI sends them
+REQUEST_KINDS = ("search", "stream", "details", "batch")
+DEFAULT_MIX = "search=4,stream=4,details=10,batch=1"
+
+# rows per page of a streamed search, SEARCH_PAGE_SIZE of lux.py (which needs PySide6, so it is
+# not imported), and ids per batch of details, a small screenful: the GUI prefetches the rows on
+# screen and PREFETCH_MARGIN more, so its batches depend on the window (up to MAX_PREFETCH)
+STREAM_PAGE_SIZE = 1000
+BATCH_SIZE = 20
+
+# numbers of values and of ids drawn from the database for the clients to ask for; the ids are
+# many, so that details requests are not all answered from the cache of the server
+SAMPLE_SIZE = 200
+ID_SAMPLE_SIZE = 10000
+
+PERCENTILES = (50, 95, 99)
+
+# seconds to wait for a spawned server to accept connections
+SPAWN_TIMEOUT = 20
+
+
+class Workload():
+    """Class for the requests of a run: search terms and object ids sampled from the database,
+    combined at random in the proportions of the mix.
+    """
+
+    def __init__(self, db_file, mix, seed=0):
+        """Samples the search terms and the ids.
+
+        Args:
+            db_file (str): database the server answers from
+            mix (dict): relative weight of each of REQUEST_KINDS
+            seed (int): seed of the samples
+        """
+
+        rng = random.Random(seed)
+        with closing(connect(db_file)) as connection:
+            with closing(connection.cursor()) as cursor:
+                ids = [row[0] for row in cursor.execute("SELECT id FROM objects ORDER BY id")]
+                labels = [row[0] for row in cursor.execute(
+                    "SELECT label FROM objects WHERE label IS NOT NULL ORDER BY id")]
+                agents = [row[0] for row in cursor.execute(
+                    "SELECT name FROM agents WHERE name IS NOT NULL ORDER BY id")]
+                classifiers = [row[0] for row in cursor.execute(
+                    "SELECT name FROM classifiers WHERE name IS NOT NULL ORDER BY id")]
+                departments = [row[0] for row in cursor.execute(
+                    "SELECT name FROM departments WHERE name IS NOT NULL ORDER BY id")]
+
+        if not ids:
+            raise ValueError(f"{db_file} has no objects")
+
+        # samples of the seed, the same for the same database
+        self._ids = rng.sample(ids, min(ID_SAMPLE_SIZE, len(ids)))
+        labels = rng.sample(labels, min(SAMPLE_SIZE, len(labels)))
+        agents = rng.sample(agents, min(SAMPLE_SIZE, len(agents)))
+
+        # a search filters on the beginning of a word of the values, as typed into the GUI
+        self._terms = {
+            "label": self._words(labels, rng),
+            "agt": self._words(agents, rng),
+            "classifier": self._words(classifiers, rng),
+            "dep": self._words(departments, rng),
+        }
+        self._kinds = [kind for kind in REQUEST_KINDS if mix.get(kind)]
+        self._weights = [mix[kind] for kind in self._kinds]
+
+    @staticmethod
+    def _words(values, rng):
+        """Returns the beginnings of words of values, the search terms of a filter."""
+
+        words = [word for value in values for word in value.split()]
+        return sorted({word[:rng.randint(2, max(2, len(word)))].lower() for word in words})
+
+    def request(self, rng):
+        """Returns a random request of the workload and its kind.
+
+        Args:
+            rng (random.Random): random generator of the client
+
+        Return:
+            tuple: kind of the request and the request
+        """
+
+        kind = rng.choices(self._kinds, self._weights)[0]
+        if kind == "details":
+            return kind, {"id": rng.choice(self._ids)}
+        if kind == "batch":
+            return kind, {"ids": rng.sample(self._ids, min(BATCH_SIZE, len(self._ids)))}
+
+        # one to three filters, as the GUI leaves the others empty
+        request = {"id": None, "label": None, "classifier": None, "agt": None, "dep": None}
+        filters = [name for name, terms in self._terms.items() if terms]
+        for name in rng.sample(filters, rng.randint(1, min(3, len(filters)))):
+            request[name] = rng.choice(self._terms[name])
+        if kind == "stream":
+            request.update(stream=True, page_size=STREAM_PAGE_SIZE)
+        return kind, request
+
+
+def read_response(conn, kind):
+    """Reads a response to the end like the GUI does, and checks that it is not an error.
+
+    Args:
+        conn (SessionConnection): connection the request was sent on
+        kind (str): kind of the request
+
+    Return:
+        str: the error message, None if the response is not an error
+    """
+
+    while True:
+        line = conn.readline()
+        if line == '':
+            return "The server closed the connection"
+        try:
+            response = json.loads(line)
+        except JSONDecodeError:
+            conn.finish()
+            return line.strip()
+        if kind != "stream":
+            conn.finish()
+            return None
+        if response.get("frame") == "error":
+            conn.finish()
+            return response.get("message")
+        if response.get("frame") in (None, "trailer"):
+            conn.finish()
+            return None
+
+
+def run_client(session, workload, seed, deadline, warmup_end, results):
+    """Sends requests one after the other until the deadline, like a user of the GUI who is
+    never idle, then closes its connections. The requests answered before warmup_end are not
+    counted, those sent before it but answered after it are (with all the time they waited).
+
+    Args:
+        session (ServerSession): connections of the client
+        workload (Workload): requests to send
+        seed (int): seed of the random generator of the client
+        deadline (float): time.monotonic() at which to stop
+        warmup_end (float): time.monotonic() at which to start counting
+        results (list): list to append (kind, start, seconds, error) of each request to
+    """
+
+    rng = random.Random(seed)
+    while (start := time.monotonic()) < deadline:
+        kind, request = workload.request(rng)
+        try:
+            with session.connection() as conn:
+                conn.send(request)
+                error = read_response(conn, kind)
+        except (OSError, ValueError) as err:
+            error = f"{type(err).__name__}: {err}"
+        seconds = time.monotonic() - start
+        if start + seconds >= warmup_end:
+            results.append((kind, start, seconds, error))
+
+    # a server that serves one session at a time waits for this one to close
+    session.close()
+
+
+def latency_stats(latencies):
+    """Summarizes the latencies of some requests.
+
+    Args:
+        latencies (list): seconds each request took
+
+    Return:
+        dict: mean, max and PERCENTILES of the latencies in milliseconds
+    """
+
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    stats = {"mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+             "max_ms": round(latencies[-1] * 1000, 3)}
+    for percentile in PERCENTILES:
+        # nearest rank
+        rank = max(1, -(-percentile * len(latencies) // 100))
+        stats[f"p{percentile}_ms"] = round(latencies[rank - 1] * 1000, 3)
+    return stats
+
+
+def summarize(results, duration):
+    """Computes the throughput, latencies and error rate of a run, overall and per kind.
+
+    Args:
+        results (list): (kind, start, seconds, error) of each request counted
+        duration (float): seconds over which the requests were counted
+
+    Return:
+        dict: summary that can be dumped to json
+    """
+
+    def summary(rows):
+        errors = [error for _, _, _, error in rows if error is not None]
+        return {"requests": len(rows),
+                "throughput_rps": round(len(rows) / duration, 3),
+                "errors": len(errors),
+                "error_rate": round(len(errors) / len(rows), 6) if rows else 0.0,
+                **latency_stats([seconds for _, _, seconds, _ in rows]),
+                "sample_errors": sorted(set(errors))[:5]}
+
+    return {"overall": summary(results),
+            "kinds": {kind: summary([row for row in results if row[0] == kind])
+                      for kind in REQUEST_KINDS if any(row[0] == kind for row in results)}}
+
+
+def server_stats(host, port):
+    """Asks the server for its stats, None if it cannot answer."""
+
+    session = ServerSession(host, port)
+    try:
+        with session.connection() as conn:
+            conn.send({"type": "stats"})
+            response = json.loads(conn.readline())
+            conn.finish()
+        return response
+    except (OSError, ValueError):
+        return None
+    finally:
+        session.close()
+
+
+def run_benchmark(host, port, workload, clients, duration, warmup=0.0, seed=0):
+    """Runs simulated clients against a server.
+
+    Args:
+        host (str): host of the server
+        port (int): port of the server
+        workload (Workload): requests to send
+        clients (int): number of concurrent clients
+        duration (float): seconds to count requests for
+        warmup (float): seconds to send requests for before counting them
+        seed (int): seed of the random generators of the clients
+
+    Return:
+        dict: summary of the run
+    """
+
+    results = []
+    sessions = [ServerSession(host, port) for _ in range(clients)]
+    warmup_end = time.monotonic() + warmup
+    deadline = warmup_end + duration
+    threads = [threading.Thread(target=run_client,
+                                args=(session, workload, seed + index, deadline, warmup_end,
+                                      results))
+               for index, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(results, duration)
+
+
+def spawn_server(server_dir, port, server_args):
+    """Starts luxserver.py in a directory that holds a lux.sqlite and waits until it accepts
+    connections.
+
+    Args:
+        server_dir (str): directory the server runs in
+        port (int): port for the server
+        server_args (list): further arguments of luxserver.py
+
+    Return:
+        subprocess.Popen: the server process
+    """
+
+    if not os.path.exists(os.path.join(server_dir, "lux.sqlite")):
+        raise FileNotFoundError(f"{server_dir} has no lux.sqlite")
+
+    server_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "luxserver.py")
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, server_file, str(port), *server_args], cwd=server_dir,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    give_up = time.monotonic() + SPAWN_TIMEOUT
+    while time.monotonic() < give_up:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with status {process.returncode}")
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The server did not start listening")
+
+
+def current_commit():
+    """Returns the git commit of this checkout, None outside of git."""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(mix_str):
+    """Parses a mix of requests such as "search=4,details=10".
+
+    Args:
+        mix_str (str): comma separated kind=weight pairs
+
+    Return:
+        dict: weight of each kind
+    """
+
+    mix = {}
+    for pair in mix_str.split(","):
+        kind, _, weight = pair.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError(f"request kinds must be among {', '.join(REQUEST_KINDS)}")
+        mix[kind] = float(weight)
+        if mix[kind] < 0:
+            raise ValueError("weights must not be negative")
+    if not any(mix.values()):
+        raise ValueError("the mix must have a positive weight")
+    return mix
+
+
+def compare(result, baseline):
+    """Returns lines comparing the overall throughput and latencies of a run to a baseline."""
+
+    lines = []
+    for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+        new, old = result["overall"].get(key), baseline["overall"].get(key)
+        if new is None or old is None:
+            continue
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        lines.append(f"{key:>15}: {old:>10} -> {new:>10} ({change})")
+    return lines
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog='lux_bench.py', allow_abbrev=False,
+        description='Load test the YUAG server with simulated clients')
+
+    parser.add_argument(
+        "port", type=int, help="the port at which the server listens")
+
+    parser.add_argument(
+        "--host", default="localhost",
+        help="the host of the server")
+
+    parser.add_argument(
+        "--db", default="./lux.sqlite",
+        help="the database the server answers from, to sample search terms and ids")
+
+    parser.add_argument(
+        "--clients", type=int, default=8,
+        help="the number of concurrent simulated clients")
+
+    parser.add_argument(
+        "--duration", type=float, default=10,
+        help="the seconds to count requests for")
+
+    parser.add_argument(
+        "--warmup", type=float, default=2,
+        help="the seconds to send requests for before counting them")
+
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX,
+        help="the relative weights of the kinds of requests: "
+        + ", ".join(REQUEST_KINDS))
+
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="the seed of the workload")
+
+    parser.add_argument(
+        "--spawn", action="store_true",
+        help="start luxserver.py on the port, in the directory of --db (named lux.sqlite)")
+
+    parser.add_argument(
+        "--server-args", default="",
+        help="further arguments for the spawned luxserver.py, such as \"--mode thread\"")
+
+    parser.add_argument(
+        "--output", default=None,
+        help="a json file to save the results to")
+
+    parser.add_argument(
+        "--baseline", default=None,
+        help="the json file of an earlier run to compare with")
+
+    args = parser.parse_args()
+
+    if args.clients < 1 or args.duration <= 0 or args.warmup < 0:
+        print("error: clients and duration must be positive and warmup must not be negative",
+              file=sys.stderr)
+        sys.exit(1)
+
+    server = None
+    try:
+        request_mix = parse_mix(args.mix)
+        bench_workload = Workload(args.db, request_mix, args.seed)
+        if args.spawn:
+            server = spawn_server(os.path.dirname(os.path.abspath(args.db)), args.port,
+                                  shlex.split(args.server_args))
+
+        started = datetime.now().isoformat(timespec='seconds')
+        bench_result = {
+            "commit": current_commit(),
+            "started": started,
+            "config": {"host": args.host, "port": args.port, "db": os.path.abspath(args.db),
+                       "clients": args.clients, "duration": args.duration,
+                       "warmup": args.warmup, "mix": request_mix, "seed": args.seed,
+                       "server_args": args.server_args if args.spawn else None},
+            **run_benchmark(args.host, args.port, bench_workload, args.clients, args.duration,
+                            args.warmup, args.seed),
+            "server_stats": server_stats(args.host, args.port),
+        }
+    except (Error, OSError, ValueError, RuntimeError) as err:
+        print(f"error: {err}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    overall = bench_result["overall"]
+    print(f"{overall['requests']} requests, {overall['throughput_rps']} requests/s, "
+          f"{overall['error_rate']:.2%} errors")
+    for kind_name, kind_summary in [("overall", overall), *bench_result["kinds"].items()]:
+        print(f"{kind_name:>8}: " + ", ".join(
+            f"{key} {kind_summary[key]}" for key in ("requests", "errors", "p50_ms", "p95_ms",
+                                                     "p99_ms", "max_ms") if key in kind_summary))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(bench_result, output_file, indent=2)
+            output_file.write("\n")
+
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding='utf-8') as baseline_file:
+                print("\n".join(compare(bench_result, json.load(baseline_file))))
+        except (OSError, ValueError, KeyError) as err:
+            print(f"error: cannot compare with {args.baseline}: {err}", file=sys.stderr)
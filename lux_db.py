@@ -0,0 +1,314 @@
+"""Module for building and refreshing the tables that the server derives from the database."""
+
+import argparse
+import sys
+
+from contextlib import closing
+from datetime import datetime
+from sqlite3 import connect, Error, OperationalError
+
+from lux_query_sql import (BUILD_JOIN_INDEX, BUILD_SEARCH_FTS, BUILD_SEARCH_META,
+                           BUILD_SEARCH_TABLE, DETAILS_AGENTS, DETAILS_AGENTS_BATCH,
+                           DETAILS_CLASSIFIERS, DETAILS_CLASSIFIERS_BATCH, DETAILS_JOIN,
+                           DETAILS_PLACES, DETAILS_PLACES_BATCH, DETAILS_REFERENCES,
+                           DETAILS_REFERENCES_BATCH, INSERT_SEARCH_META, JOIN_INDEXES,
+                           JOIN_INDEXES_EXIST, POPULATE_SEARCH_FTS, QUERY_LUX, SEARCH_FTS,
+                           SEARCH_FTS_IS_FRESH, SEARCH_SOURCE_TABLES, SEARCH_STALE_TRIGGER,
+                           SEARCH_TABLE, SEARCH_TABLE_INDEXES, SEARCH_TABLE_IS_FRESH)
+
+
+DB_NAME = "./lux.sqlite"
+TRIGGER_EVENTS = ("INSERT", "UPDATE", "DELETE")
+
+# Queries whose plans the optimize command inspects, with parameters to explain them with
+# (the batch queries for a single id)
+EXPLAINED_QUERIES = {
+    "search": (QUERY_LUX, []),
+    "details join": (DETAILS_JOIN, [0]),
+    "details agents": (DETAILS_AGENTS, [0]),
+    "details references": (DETAILS_REFERENCES, [0]),
+    "details classifiers": (DETAILS_CLASSIFIERS, [0]),
+    "details places": (DETAILS_PLACES, [0]),
+    "details agents batch": (DETAILS_AGENTS_BATCH.format(ids="?"), [0]),
+    "details references batch": (DETAILS_REFERENCES_BATCH.format(ids="?"), [0]),
+    "details classifiers batch": (DETAILS_CLASSIFIERS_BATCH.format(ids="?"), [0]),
+    "details places batch": (DETAILS_PLACES_BATCH.format(ids="?"), [0]),
+}
+
+
+def search_table_is_fresh(cursor):
+    """Checks whether the search table exists and no source table was written since it was built.
+
+    Args:
+        cursor: cursor of an open connection
+
+    Return:
+        bool: True if the search table can be used in place of QUERY_LUX
+    """
+
+    try:
+        row = cursor.execute(SEARCH_TABLE_IS_FRESH).fetchone()
+    except OperationalError:
+        return False
+    return bool(row and row[0])
+
+
+def search_fts_is_fresh(cursor):
+    """Checks whether the search table is fresh and was built with its full-text index.
+
+    Args:
+        cursor: cursor of an open connection
+
+    Return:
+        bool: True if the full-text index can be used to find search rows
+    """
+
+    try:
+        row = cursor.execute(SEARCH_FTS_IS_FRESH).fetchone()
+    except OperationalError:
+        return False
+    return bool(row and row[0])
+
+
+def join_indexes_exist(cursor, tables):
+    """Checks whether the optimize command has indexed the join keys of some tables.
+
+    Args:
+        cursor: cursor of an open connection
+        tables (list): keys of JOIN_INDEXES
+
+    Return:
+        bool: True if every one of the tables has its index
+    """
+
+    names = [JOIN_INDEXES[table][0] for table in tables]
+    row = cursor.execute(JOIN_INDEXES_EXIST.format(names=", ".join("?" * len(names))),
+                         names).fetchone()
+    return row[0] == len(names)
+
+
+def drop_search_table(cursor):
+    """Drops the search table together with its metadata and triggers.
+
+    Args:
+        cursor: cursor of an open connection
+    """
+
+    for table in SEARCH_SOURCE_TABLES:
+        for event in TRIGGER_EVENTS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_stale_{table}_{event}")
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_FTS}")
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}_meta")
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def build_search_table(db_file, fts=False):
+    """(Re)builds the search table with the rows of QUERY_LUX, its indexes and the triggers
+    that mark it as stale when a source table changes. Runs in a single transaction.
+
+    Args:
+        db_file (str): database file
+        fts (bool): also build the trigram full-text index over the search table
+    """
+
+    with closing(connect(db_file, isolation_level=None)) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                drop_search_table(cursor)
+                cursor.execute(BUILD_SEARCH_TABLE)
+                for index in SEARCH_TABLE_INDEXES:
+                    cursor.execute(index)
+                if fts:
+                    cursor.execute(BUILD_SEARCH_FTS)
+                    cursor.execute(POPULATE_SEARCH_FTS)
+                cursor.execute(BUILD_SEARCH_META)
+                cursor.execute(INSERT_SEARCH_META,
+                               [int(fts), datetime.now().isoformat(timespec='seconds')])
+                for table in SEARCH_SOURCE_TABLES:
+                    for event in TRIGGER_EVENTS:
+                        cursor.execute(SEARCH_STALE_TRIGGER.format(table=table, event=event))
+                cursor.execute("COMMIT")
+            except Error:
+                cursor.execute("ROLLBACK")
+                raise
+
+
+def refresh_search_table(db_file, fts=False):
+    """Rebuilds the search table if it is missing or stale, or if the full-text index is
+    requested but missing. A full-text index that already exists is rebuilt as well.
+
+    Args:
+        db_file (str): database file
+        fts (bool): make sure the full-text index is built
+
+    Return:
+        bool: True if the table was rebuilt
+    """
+
+    with closing(connect(db_file, isolation_level=None)) as connection:
+        with closing(connection.cursor()) as cursor:
+            if search_fts_is_fresh(cursor) or (not fts and search_table_is_fresh(cursor)):
+                return False
+            fts = fts or cursor.execute(
+                "SELECT count(*) FROM sqlite_schema WHERE name = ?", [SEARCH_FTS]).fetchone()[0]
+
+    build_search_table(db_file, fts=bool(fts))
+    return True
+
+
+def remove_search_table(db_file):
+    """Removes the search table, so that searches go back to QUERY_LUX.
+
+    Args:
+        db_file (str): database file
+    """
+
+    with closing(connect(db_file, isolation_level=None)) as connection:
+        with closing(connection.cursor()) as cursor:
+            drop_search_table(cursor)
+
+
+def explain_query(cursor, smt_str, smt_params):
+    """Explains a statement.
+
+    Args:
+        cursor: cursor of an open connection
+        smt_str (str): SQL statement
+        smt_params (list): its parameters
+
+    Return:
+        list: lines of its EXPLAIN QUERY PLAN, each indented by two spaces per level of the plan
+    """
+
+    depths = {0: -1}
+    plan = []
+    for node, parent, _, detail in cursor.execute(f"EXPLAIN QUERY PLAN {smt_str}",
+                                                  smt_params).fetchall():
+        depths[node] = depths.get(parent, -1) + 1
+        plan.append("  " * depths[node] + detail)
+    return plan
+
+
+def query_plans(cursor):
+    """Explains the search and details queries.
+
+    Args:
+        cursor: cursor of an open connection
+
+    Return:
+        dict: plan of each of EXPLAINED_QUERIES, as made by explain_query
+    """
+
+    return {name: explain_query(cursor, smt_str, smt_params)
+            for name, (smt_str, smt_params) in EXPLAINED_QUERIES.items()}
+
+
+def missing_indexes(plans):
+    """Finds the tables of JOIN_INDEXES that a plan reads in full, or through an index that
+    SQLite builds for the query because the table has none.
+
+    Args:
+        plans (dict): query plans made by query_plans
+
+    Return:
+        list: names of the tables
+    """
+
+    details = [line.strip() for plan in plans.values() for line in plan]
+    return [table for table in JOIN_INDEXES
+            if any(detail.split()[:2] == ["SCAN", table] or
+                   detail.startswith(f"SEARCH {table} USING AUTOMATIC") for detail in details)]
+
+
+def optimize_indexes(db_file):
+    """Creates the covering indexes that the plans of the search and details queries are
+    missing, then runs ANALYZE so that the query planner has statistics to choose them by.
+    Runs in a single transaction.
+
+    Args:
+        db_file (str): database file
+
+    Return:
+        tuple: query plans before, tables indexed, query plans after
+    """
+
+    with closing(connect(db_file, isolation_level=None)) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                before = query_plans(cursor)
+                tables = missing_indexes(before)
+                for table in tables:
+                    name, columns = JOIN_INDEXES[table]
+                    cursor.execute(BUILD_JOIN_INDEX.format(name=name, table=table,
+                                                           columns=columns))
+                cursor.execute("ANALYZE")
+                cursor.execute("COMMIT")
+            except Error:
+                cursor.execute("ROLLBACK")
+                raise
+            after = query_plans(cursor)
+
+    return before, tables, after
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog='lux_db.py', allow_abbrev=False,
+        description='Maintains the derived tables used by the YUAG server')
+
+    parser.add_argument(
+        "command", choices=["build", "refresh", "drop", "optimize", "check"],
+        help="build: rebuild the search table, refresh: rebuild it only if it is stale, "
+        "drop: remove it, optimize: index the join keys the search and details queries scan "
+        "and report their query plans, check: make sure both details engines return the same "
+        "details for every object")
+
+    parser.add_argument(
+        "--db", default=DB_NAME, help="the database file")
+
+    parser.add_argument(
+        "--fts", action="store_true",
+        help="also build the trigram full-text index used by the fts search mode")
+
+    args = parser.parse_args()
+
+    # query.py imports this module, so it can only be imported once this module is loaded
+    from query import compare_details_engines  # pylint: disable=wrong-import-position
+
+    try:
+        if args.command == "build":
+            build_search_table(args.db, fts=args.fts)
+            print(f"Built {SEARCH_TABLE}")
+        elif args.command == "refresh":
+            if refresh_search_table(args.db, fts=args.fts):
+                print(f"Rebuilt stale {SEARCH_TABLE}")
+            else:
+                print(f"{SEARCH_TABLE} is up to date")
+        elif args.command == "drop":
+            remove_search_table(args.db)
+            print(f"Dropped {SEARCH_TABLE}")
+        elif args.command == "check":
+            compared, differing = compare_details_engines(args.db)
+            if differing:
+                print(f"Details engines differ on {len(differing)} of {compared} objects: "
+                      f"{', '.join(map(str, differing[:20]))}", file=sys.stderr)
+                sys.exit(1)
+            print(f"Details engines agree on {compared} objects")
+        else:
+            plans_before, indexed, plans_after = optimize_indexes(args.db)
+            for query_name, plan in plans_before.items():
+                print(f"{query_name}:")
+                print("  before:")
+                print("\n".join(f"    {line}" for line in plan))
+                print("  after:")
+                print("\n".join(f"    {line}" for line in plans_after[query_name]))
+            if indexed:
+                print(f"Indexed {', '.join(indexed)} and analyzed the database")
+            else:
+                print("No index missing; analyzed the database")
+    except Error as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,386 @@
+"""Module for micro-benchmarks of the hot paths of query.py and table.py on synthetic inputs of
+several sizes, with a check of the timings against those of an earlier run, so that changes to
+the post-processing and rendering code can be judged with numbers.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from sqlite3 import Error
+
+from lux_bench import current_commit
+from lux_db import optimize_indexes
+from lux_synth import COLLECTION_SIZE, generate, scaled_size
+from query import LuxDetailsQuery, LuxQuery
+import table
+from table import Table
+
+# numbers of rows of the inputs (of objects in the databases searched)
+SIZES = (10, 1000, 100000)
+
+# fraction by which a benchmark may be slower than in the baseline before it is a regression
+DEFAULT_THRESHOLD = 0.25
+
+DEFAULT_REPEAT = 5
+
+# seconds each repetition of a benchmark runs for at least
+MIN_TIME = 0.2
+
+# search terms that each match part of a synthetic database
+SEARCH_TERMS = {"label": "ri", "agt": "ho", "classifier": "print", "dep": "an"}
+
+WORDS = ("portrait", "landscape", "river", "bowl", "vase", "mask", "coin", "print", "study",
+         "ship", "head", "figure", "jar", "plate", "garden", "Étude", "Nocturne", "Madonna")
+NAMES = ("John Trumbull", "Mary Cassatt", "Katsushika Hokusai", "Winslow Homer", "Frans Hals",
+         "John Singleton Copley", "Utagawa Hiroshige", "James McNeill Whistler")
+PARTS = ("artist", "maker", "printer", "publisher", "after")
+CLASSIFIERS = ("paintings", "prints", "drawings", "sculpture", "coins", "ceramics")
+DEPARTMENTS = ("American Paintings and Sculpture", "Prints and Drawings", "Numismatics")
+REFERENCE_TYPES = ("inscription", "signature", "note", "provenance", "exhibition")
+
+# the details of an object join its agents, classifiers and references: the rows repeat these
+DETAILS_CLASSIFIERS = 6
+DETAILS_REFERENCES = 25
+
+
+class Benchmark():
+    """Class for one benchmark: a function and a way to make its arguments. The arguments are
+    made before the timing; those of a benchmark with fresh set are made anew for every call,
+    because the function changes them.
+    """
+
+    def __init__(self, name, size, function, make_args, fresh=False):
+        """Stores the benchmark.
+
+        Args:
+            name (str): name of the function benchmarked
+            size (int): number of rows of its input
+            function (callable): function to time
+            make_args (callable): returns a tuple of arguments for function
+            fresh (bool): whether every call needs arguments of its own
+        """
+
+        self.name = name
+        self.size = size
+        self._function = function
+        self._make_args = make_args
+        self._fresh = fresh
+
+    @property
+    def key(self):
+        """Returns the key of the benchmark in the results."""
+
+        return f"{self.name}/{self.size}"
+
+    def run(self, repeat=DEFAULT_REPEAT, min_time=MIN_TIME):
+        """Times the function.
+
+        Args:
+            repeat (int): number of repetitions, the fastest of which counts
+            min_time (float): seconds each repetition runs for at least
+
+        Return:
+            float: seconds per call
+        """
+
+        if not self._fresh:
+            args = self._make_args()
+            timer = timeit.Timer(lambda: self._function(*args))
+            number = max(1, math.ceil(min_time / self._time([args])))
+            return min(timer.repeat(repeat, number)) / number
+
+        number = max(1, math.ceil(min_time / self._time([self._make_args()])))
+        return min(self._time([self._make_args() for _ in range(number)])
+                   for _ in range(repeat)) / number
+
+    def _time(self, args_list):
+        """Returns the seconds it takes to call the function with each of args_list."""
+
+        function = self._function
+        start = timeit.default_timer()
+        for args in args_list:
+            function(*args)
+        return timeit.default_timer() - start
+
+
+def search_rows(size, rng):
+    """Returns rows as the search query returns them (id, label, artist, date, department,
+    classification).
+    """
+
+    return [(obj_id, " ".join(rng.sample(WORDS, rng.randint(1, 4))).capitalize(),
+             ",".join(f"{rng.choice(NAMES)} ({rng.choice(PARTS)})"
+                      for _ in range(rng.randint(1, 3))),
+             str(rng.randint(1400, 2020)), rng.choice(DEPARTMENTS),
+             ", ".join(sorted(rng.sample(CLASSIFIERS, rng.randint(1, 2)))))
+            for obj_id in range(1, size + 1)]
+
+
+def dates(size, rng):
+    """Returns (begin_date, end_date) pairs of agents, some of them missing."""
+
+    def date():
+        if rng.random() < 0.2:
+            return None
+        return f"{rng.randint(1400, 2000)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    return [(date(), date()) for _ in range(size)]
+
+
+def details_rows(size, rng):
+    """Returns rows as the details query returns them for one object, the agents of the object
+    joined with its classifiers and references.
+    """
+
+    agents = max(1, size // (DETAILS_CLASSIFIERS * DETAILS_REFERENCES))
+    begin_end = dates(agents, rng)
+    references = [(rng.choice(REFERENCE_TYPES), f"{rng.choice(WORDS)} {index}")
+                  for index in range(DETAILS_REFERENCES)]
+    return [("River landscape", PARTS[index % agents % len(PARTS)],
+             NAMES[index % agents % len(NAMES)], *begin_end[index % agents],
+             rng.choice(WORDS).capitalize() + "ian",
+             CLASSIFIERS[index % DETAILS_CLASSIFIERS], *references[index % DETAILS_REFERENCES],
+             index % agents, "1961.18.1", "1812", "New Haven")
+            for index in range(size)]
+
+
+def agent_dict(size, rng):
+    """Returns the agents of an object as LuxDetailsQuery.clean_data returns them."""
+
+    return {agt_id: {"part": rng.choice(PARTS), "name": rng.choice(NAMES),
+                     "timespan": f"{rng.randint(1400, 1900)}-{rng.randint(1900, 2000)}",
+                     "nationality": [rng.choice(WORDS).capitalize() + "ian"
+                                     for _ in range(rng.randint(1, 3))]}
+            for agt_id in range(size)}
+
+
+def table_rows(size, rng):
+    """Returns rows of the search results table of the GUI."""
+
+    return [[str(row[0]), row[1], row[3], row[2].replace(",", "|"), row[5]]
+            for row in search_rows(size, rng)]
+
+
+def make_table(rows):
+    """Returns a table of search results whose column widths are yet to be computed."""
+
+    return Table(["Id", "Label", "Date", "Artist", "Classification"], rows, format_str="wwwpw",
+                 max_width=100)
+
+
+def render_table(a_table):
+    """Formats a table with the wrapping cache emptied, as a table of new search results is."""
+
+    table._wrap.cache_clear()  # pylint: disable=protected-access
+    return str(a_table)
+
+
+def synthetic_db(db_dir, objects):
+    """Returns a synthetic database of a number of objects, optimized like a deployed one.
+    An existing one in db_dir is reused.
+
+    Args:
+        db_dir (str): directory of the databases
+        objects (int): number of objects
+
+    Return:
+        str: database file
+    """
+
+    db_file = os.path.join(db_dir, f"synthetic_{objects}.sqlite")
+    if not os.path.exists(db_file):
+        generate(db_file, scaled_size(COLLECTION_SIZE, objects / COLLECTION_SIZE["objects"]))
+        optimize_indexes(db_file)
+    return db_file
+
+
+def benchmarks(sizes, db_dir, match=None, seed=0):
+    """Lists the benchmarks for inputs of the given sizes. Each input is made from its own
+    random generator, so it is the same whichever benchmarks are selected.
+
+    Args:
+        sizes (list): numbers of rows of the inputs
+        db_dir (str): directory of the synthetic databases to search
+        match (str): only the benchmarks whose name contains it, all if None
+        seed (int): seed of the inputs
+
+    Return:
+        generator of Benchmark
+    """
+
+    def wanted(name):
+        return not match or match in name
+
+    # the methods benchmarked do not use the database, except search
+    details_query = LuxDetailsQuery(None)
+
+    for size in sizes:
+        searches = {f"LuxQuery.search[{'+'.join(filters) or 'all'}]": filters
+                    for count in range(len(SEARCH_TERMS) + 1)
+                    for filters in itertools.combinations(SEARCH_TERMS, count)}
+        searches = {name: filters for name, filters in searches.items() if wanted(name)}
+        search_query = LuxQuery(synthetic_db(db_dir, size) if searches else None)
+        for name, filters in searches.items():
+            terms = {filter_name: SEARCH_TERMS[filter_name] for filter_name in filters}
+            yield Benchmark(name, size,
+                            lambda terms=terms, query=search_query: query.search(**terms), tuple)
+
+        if wanted("LuxQuery.convert_to_json"):
+            rows = search_rows(size, random.Random(seed))
+            yield Benchmark("LuxQuery.convert_to_json", size, search_query.convert_to_json,
+                            lambda rows=rows: (len(rows), list(rows)), fresh=True)
+
+        if wanted("LuxDetailsQuery.clean_data"):
+            rows = details_rows(size, random.Random(seed))
+            yield Benchmark("LuxDetailsQuery.clean_data", size, details_query.clean_data,
+                            lambda rows=rows: (rows,))
+
+        if wanted("LuxDetailsQuery.sort_by_order_ref"):
+            rng = random.Random(seed)
+            references = [(rng.choice(REFERENCE_TYPES), f"{rng.choice(WORDS)} {index}")
+                          for index in range(size)]
+            yield Benchmark("LuxDetailsQuery.sort_by_order_ref", size,
+                            details_query.sort_by_order_ref,
+                            lambda references=references: ([ref[0] for ref in references],
+                                                           [ref[1] for ref in references]))
+
+        if wanted("LuxDetailsQuery.format_data"):
+            agents = agent_dict(size, random.Random(seed))
+            yield Benchmark("LuxDetailsQuery.format_data", size, details_query.format_data,
+                            lambda agents=agents: ({agt_id: dict(
+                                agent, nationality=list(agent["nationality"]))
+                                for agt_id, agent in agents.items()},),
+                            fresh=True)
+
+        if wanted("LuxDetailsQuery.parse_date"):
+            begin_end = dates(size, random.Random(seed))
+            yield Benchmark("LuxDetailsQuery.parse_date", size,
+                            lambda begin_end: [details_query.parse_date(*pair)
+                                               for pair in begin_end],
+                            lambda begin_end=begin_end: (begin_end,))
+
+        rows = table_rows(size, random.Random(seed)) if wanted("Table.") else None
+        if wanted("Table.column_widths"):
+            yield Benchmark("Table.column_widths", size, lambda a_table: a_table.column_widths,
+                            lambda rows=rows: (make_table(rows),), fresh=True)
+
+        if wanted("Table._redistribute_widths"):
+            nominal_table = make_table(rows)
+            nominal_widths = nominal_table._nominal_widths()  # pylint: disable=protected-access
+            yield Benchmark("Table._redistribute_widths", size,
+                            nominal_table._redistribute_widths,  # pylint: disable=protected-access
+                            lambda nominal_widths=nominal_widths: (nominal_widths,))
+
+        if wanted("Table.__str__"):
+            yield Benchmark("Table.__str__", size, render_table,
+                            lambda rows=rows: (make_table(rows),), fresh=True)
+
+
+def regressions(results, baseline, threshold):
+    """Compares timings with those of a baseline.
+
+    Args:
+        results (dict): seconds per call of each benchmark
+        baseline (dict): seconds per call of each benchmark in an earlier run
+        threshold (float): fraction by which a benchmark may be slower
+
+    Return:
+        dict: ratio of the timing to that of the baseline of each benchmark slower than the
+        threshold allows
+    """
+
+    return {key: seconds / baseline[key] for key, seconds in results.items()
+            if baseline.get(key) and seconds > baseline[key] * (1 + threshold)}
+
+
+def format_seconds(seconds):
+    """Returns a duration with a unit that suits it."""
+
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog='lux_microbench.py', allow_abbrev=False,
+        description='Time the hot paths of query.py and table.py')
+
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=list(SIZES),
+        help="the numbers of rows of the inputs")
+
+    parser.add_argument(
+        "--match", default=None,
+        help="only run the benchmarks whose name contains this string")
+
+    parser.add_argument(
+        "--repeat", type=int, default=DEFAULT_REPEAT,
+        help="the number of repetitions of each benchmark, the fastest of which counts")
+
+    parser.add_argument(
+        "--db-dir", default=None,
+        help="a directory to keep the synthetic databases in between runs")
+
+    parser.add_argument(
+        "--output", default=None,
+        help="a json file to save the results to")
+
+    parser.add_argument(
+        "--baseline", default=None,
+        help="the json file of an earlier run; the exit status is 1 if a benchmark regressed")
+
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="the fraction by which a benchmark may be slower than in the baseline")
+
+    args = parser.parse_args()
+
+    if min(args.sizes) < 1 or args.repeat < 1 or args.threshold < 0:
+        print("error: sizes and repeat must be positive and threshold must not be negative",
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        baseline_results = None
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as baseline_file:
+                baseline_results = json.load(baseline_file)["results"]
+
+        bench_results = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for benchmark in benchmarks(args.sizes, args.db_dir or temp_dir, args.match):
+                bench_results[benchmark.key] = benchmark.run(args.repeat)
+                print(f"{benchmark.key}: {format_seconds(bench_results[benchmark.key])}",
+                      flush=True)
+    except (Error, OSError, ValueError, KeyError) as err:
+        print(f"error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({"commit": current_commit(), "results": bench_results}, output_file,
+                      indent=2)
+            output_file.write("\n")
+
+    if baseline_results is not None:
+        print(Table(["Benchmark", "Baseline", "Now", "Change"],
+                    [[key, format_seconds(baseline_results[key]), format_seconds(seconds),
+                      f"{seconds / baseline_results[key] - 1:+.1%}"]
+                     for key, seconds in bench_results.items() if baseline_results.get(key)],
+                    max_width=100))
+        slower = regressions(bench_results, baseline_results, args.threshold)
+        if slower:
+            print(f"\n{len(slower)} benchmarks regressed by more than {args.threshold:.0%}: "
+                  + ", ".join(f"{key} ({ratio:.2f}x)" for key, ratio in slower.items()),
+                  file=sys.stderr)
+            sys.exit(1)
@@ -1,4 +1,4 @@
-"""Module for main query in LuxQuery class in query.py."""
+"""Module for the SQL queries used by the LuxQuery and LuxDetailsQuery classes in query.py."""
 
 QUERY_LUX = """WITH classifier AS (
     SELECT id, group_concat(cls_name, ', ') as classification FROM (
@@ -31,3 +31,250 @@ LEFT OUTER JOIN classifier ON classifier.id = objects.id
 LEFT OUTER JOIN agent ON agent.id = objects.id
 LEFT OUTER JOIN department ON department.id = objects.id
 """
+
+# QUERY_LUX restricted to the candidate objects, those that satisfy {filter} (a condition on
+# objects built from CANDIDATE_FILTERS by LuxQuery): the CTEs only aggregate the classifiers,
+# agents and departments of the candidates, instead of those of every object.
+QUERY_LUX_CANDIDATES = """WITH candidate AS (
+    SELECT objects.id FROM objects WHERE {filter}
+),
+classifier AS (
+    SELECT id, group_concat(cls_name, ', ') as classification FROM (
+        SELECT objects.id, LOWER(classifiers.name) AS cls_name
+        FROM objects
+        LEFT OUTER JOIN objects_classifiers ON objects_classifiers.obj_id = objects.id
+        LEFT OUTER JOIN classifiers ON classifiers.id = objects_classifiers.cls_id
+        WHERE objects.id IN (SELECT id FROM candidate)
+        ORDER BY LOWER(classifiers.name)
+    )
+GROUP BY id),
+agent as (
+    SELECT id, GROUP_CONCAT(agt_name || ' (' || prod_part || ')') as artist FROM (
+        SELECT objects.id, agents.name as agt_name, productions.part as prod_part
+        FROM objects
+        LEFT OUTER JOIN productions ON productions.obj_id = objects.id
+        LEFT OUTER JOIN agents ON productions.agt_id = agents.id
+        WHERE objects.id IN (SELECT id FROM candidate)
+        ORDER BY objects.id, productions.agt_id, productions.part, productions.rowid
+    )
+GROUP BY id),
+department as (
+        SELECT objects.id, departments.name as dep_name
+        FROM objects
+        LEFT OUTER JOIN objects_departments ON objects_departments.obj_id = objects.id
+        LEFT OUTER JOIN departments ON departments.id = objects_departments.dep_id
+        WHERE objects.id IN (SELECT id FROM candidate)
+)
+
+SELECT objects.id, objects.label, agent.artist, 
+objects.date,  department.dep_name, classifier.classification
+FROM candidate
+JOIN objects ON objects.id = candidate.id
+LEFT OUTER JOIN classifier ON classifier.id = objects.id
+LEFT OUTER JOIN agent ON agent.id = objects.id
+LEFT OUTER JOIN department ON department.id = objects.id
+"""
+
+# Link tables that QUERY_LUX_CANDIDATES reads per candidate; without their JOIN_INDEXES, SQLite
+# scans each of them once per candidate.
+CANDIDATE_TABLES = ["objects_classifiers", "productions", "objects_departments"]
+
+# Conditions on the objects of QUERY_LUX_CANDIDATES for each search filter, with one LIKE pattern
+# each: the object has a label, a department, an agent (as it appears in agent.artist) or a
+# classifier (as it appears in classifier.classification) that matches the pattern.
+CANDIDATE_FILTERS = {
+    "label": "objects.label LIKE ?",
+    "dep": """EXISTS (SELECT 1 FROM objects_departments
+    JOIN departments ON departments.id = objects_departments.dep_id
+    WHERE objects_departments.obj_id = objects.id AND departments.name LIKE ?)""",
+    "agt": """EXISTS (SELECT 1 FROM productions
+    JOIN agents ON agents.id = productions.agt_id
+    WHERE productions.obj_id = objects.id
+    AND agents.name || ' (' || productions.part || ')' LIKE ?)""",
+    "classifier": """EXISTS (SELECT 1 FROM objects_classifiers
+    JOIN classifiers ON classifiers.id = objects_classifiers.cls_id
+    WHERE objects_classifiers.obj_id = objects.id AND LOWER(classifiers.name) LIKE ?)""",
+}
+
+# Materialized copy of the rows of QUERY_LUX, built by lux_db.py so that searches do not have to
+# rebuild the classifier, agent and department CTEs on every request.
+SEARCH_TABLE = "lux_search"
+
+# Tables QUERY_LUX reads from; writing to any of them marks the search table as stale.
+SEARCH_SOURCE_TABLES = ["objects", "objects_classifiers", "classifiers", "productions",
+                        "agents", "objects_departments", "departments"]
+
+BUILD_SEARCH_TABLE = f"""CREATE TABLE {SEARCH_TABLE} AS {QUERY_LUX}"""
+
+SEARCH_TABLE_INDEXES = [
+    f"CREATE INDEX {SEARCH_TABLE}_id ON {SEARCH_TABLE} (id)",
+    f"CREATE INDEX {SEARCH_TABLE}_sort ON {SEARCH_TABLE} (label, date, id)",
+]
+
+BUILD_SEARCH_META = f"""CREATE TABLE {SEARCH_TABLE}_meta (
+    stale INTEGER NOT NULL,
+    fts INTEGER NOT NULL DEFAULT 0,
+    built_at TEXT NOT NULL
+)"""
+
+# one trigger per source table and statement type, named {SEARCH_TABLE}_stale_{table}_{event}
+SEARCH_STALE_TRIGGER = f"""CREATE TRIGGER {SEARCH_TABLE}_stale_{{table}}_{{event}}
+AFTER {{event}} ON {{table}}
+BEGIN
+    UPDATE {SEARCH_TABLE}_meta SET stale = 1;
+END"""
+
+SEARCH_TABLE_IS_FRESH = f"SELECT stale = 0 FROM {SEARCH_TABLE}_meta"
+
+# Optional trigram full-text index over the searchable columns of the search table. Its rows share
+# their rowid with the search table, which it reads its content from.
+SEARCH_FTS = f"{SEARCH_TABLE}_fts"
+
+SEARCH_FTS_COLUMNS = ["label", "artist", "classification", "dep_name"]
+
+BUILD_SEARCH_FTS = f"""CREATE VIRTUAL TABLE {SEARCH_FTS} USING fts5(
+    {", ".join(SEARCH_FTS_COLUMNS)},
+    content='{SEARCH_TABLE}', content_rowid='rowid', tokenize='trigram'
+)"""
+
+POPULATE_SEARCH_FTS = f"INSERT INTO {SEARCH_FTS}({SEARCH_FTS}) VALUES ('rebuild')"
+
+SEARCH_FTS_IS_FRESH = f"SELECT stale = 0 AND fts FROM {SEARCH_TABLE}_meta"
+
+QUERY_LUX_MATERIALIZED = f"""SELECT {SEARCH_TABLE}.id, {SEARCH_TABLE}.label, {SEARCH_TABLE}.artist,
+{SEARCH_TABLE}.date, {SEARCH_TABLE}.dep_name, {SEARCH_TABLE}.classification
+FROM {SEARCH_TABLE}
+"""
+
+# Names of the columns of each source of search rows, used in the WHERE, GROUP BY and ORDER BY
+# clauses LuxQuery appends to the query of that source.
+SEARCH_COLUMNS = {
+    "cte": {
+        "id": "objects.id",
+        "label": "objects.label",
+        "artist": "agent.artist",
+        "date": "objects.date",
+        "dep_name": "department.dep_name",
+        "classification": "classifier.classification",
+    },
+    "materialized": {column: f"{SEARCH_TABLE}.{column}" for column in
+                     ["id", "label", "artist", "date", "dep_name", "classification"]},
+}
+SEARCH_COLUMNS["fts"] = SEARCH_COLUMNS["materialized"]
+
+SEARCH_QUERIES = {
+    "cte": QUERY_LUX,
+    "materialized": QUERY_LUX_MATERIALIZED,
+    "fts": QUERY_LUX_MATERIALIZED,
+}
+
+INSERT_SEARCH_META = f"INSERT INTO {SEARCH_TABLE}_meta (stale, fts, built_at) VALUES (0, ?, ?)"
+
+# Covering indexes on the join keys of QUERY_LUX and of the details queries, one per link table,
+# which lux_db.py creates when a query plan reads the table in full or through an automatic index.
+# Each has the columns of the automatic index SQLite would build (the join key, then the other
+# columns the queries read, in table order), so QUERY_LUX aggregates rows in the same order.
+# The details queries do not depend on them: they order their rows explicitly.
+JOIN_INDEXES = {
+    "productions": ("productions_obj_id", "obj_id, agt_id, part"),
+    "agents_nationalities": ("agents_nationalities_agt_id", "agt_id, nat_id"),
+    "references": ("references_obj_id", "obj_id, type, content"),
+    "objects_classifiers": ("objects_classifiers_obj_id", "obj_id, cls_id"),
+    "objects_places": ("objects_places_obj_id", "obj_id, pl_id"),
+    "objects_departments": ("objects_departments_obj_id", "obj_id, dep_id"),
+}
+
+BUILD_JOIN_INDEX = 'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'
+
+JOIN_INDEXES_EXIST = "SELECT count(*) FROM sqlite_schema WHERE type = 'index' AND name IN ({names})"
+
+# Query of the "join" details engine of LuxDetailsQuery: every relation of the object in one join.
+# objects.label, productions.part, agents.name, agents.begin_date, agents.end_date,
+# nationalities.descriptor, classifiers.name, "references".type, "references".content, agents.id,
+# and the additional data objects.accession_no, objects.date, places.label
+# Rows come in the order of the productions of the object, whether or not productions is indexed,
+# since clean_data keeps the part of the first row of an agent with several parts.
+DETAILS_JOIN = """SELECT DISTINCT objects.label, productions.part, agents.name,
+agents.begin_date, agents.end_date, nationalities.descriptor, classifiers.name,
+"references".type, "references".content, agents.id,
+objects.accession_no, objects.date, places.label
+FROM objects
+LEFT OUTER JOIN productions ON productions.obj_id = objects.id
+LEFT OUTER JOIN agents on productions.agt_id = agents.id
+LEFT OUTER JOIN agents_nationalities ON agents_nationalities.agt_id = agents.id
+LEFT OUTER JOIN nationalities ON nationalities.id = agents_nationalities.nat_id
+LEFT OUTER JOIN "references" ON "references".obj_id = objects.id
+LEFT OUTER JOIN objects_classifiers ON objects_classifiers.obj_id = objects.id
+LEFT OUTER JOIN classifiers ON classifiers.id = objects_classifiers.cls_id
+LEFT OUTER JOIN objects_places ON objects_places.obj_id = objects.id
+LEFT OUTER JOIN places ON objects_places.pl_id = places.id
+WHERE objects.id = ?
+ORDER BY productions.rowid, agents_nationalities.nat_id, agents_nationalities.rowid,
+"references".type, "references".content, "references".rowid,
+objects_classifiers.cls_id, objects_classifiers.rowid, objects_places.pl_id, objects_places.rowid"""
+
+# Queries of the "relations" details engine of LuxDetailsQuery, one per relation of an object.
+# Rows come in the order of the ORDER BY of DETAILS_JOIN: productions in rowid order, the rows of
+# the other link tables in the order of the columns the join uses.
+DETAILS_OBJECT = """SELECT objects.label, objects.accession_no, objects.date
+FROM objects
+WHERE objects.id = ?"""
+
+DETAILS_AGENTS = """SELECT productions.part, agents.name, agents.begin_date, agents.end_date,
+nationalities.descriptor, agents.id
+FROM productions
+LEFT OUTER JOIN agents ON productions.agt_id = agents.id
+LEFT OUTER JOIN agents_nationalities ON agents_nationalities.agt_id = agents.id
+LEFT OUTER JOIN nationalities ON nationalities.id = agents_nationalities.nat_id
+WHERE productions.obj_id = ?
+ORDER BY productions.rowid, agents_nationalities.nat_id, agents_nationalities.rowid"""
+
+DETAILS_REFERENCES = """SELECT "references".type, "references".content
+FROM "references"
+WHERE "references".obj_id = ?
+ORDER BY "references".type, "references".content, "references".rowid"""
+
+DETAILS_CLASSIFIERS = """SELECT classifiers.name
+FROM objects_classifiers
+LEFT OUTER JOIN classifiers ON classifiers.id = objects_classifiers.cls_id
+WHERE objects_classifiers.obj_id = ?
+ORDER BY objects_classifiers.cls_id, objects_classifiers.rowid"""
+
+DETAILS_PLACES = """SELECT places.label
+FROM objects_places
+LEFT OUTER JOIN places ON objects_places.pl_id = places.id
+WHERE objects_places.obj_id = ?
+ORDER BY objects_places.pl_id, objects_places.rowid"""
+
+# Queries of the batch details lookup (LuxDetailsQuery.search_batch): the same rows as the
+# queries above for every object in the {ids} list of placeholders, tagged with the object id.
+DETAILS_OBJECT_BATCH = """SELECT objects.id, objects.label, objects.accession_no, objects.date
+FROM objects
+WHERE objects.id IN ({ids})"""
+
+DETAILS_AGENTS_BATCH = """SELECT productions.obj_id, productions.part, agents.name,
+agents.begin_date, agents.end_date, nationalities.descriptor, agents.id
+FROM productions
+LEFT OUTER JOIN agents ON productions.agt_id = agents.id
+LEFT OUTER JOIN agents_nationalities ON agents_nationalities.agt_id = agents.id
+LEFT OUTER JOIN nationalities ON nationalities.id = agents_nationalities.nat_id
+WHERE productions.obj_id IN ({ids})
+ORDER BY productions.obj_id, productions.rowid, agents_nationalities.nat_id,
+agents_nationalities.rowid"""
+
+DETAILS_REFERENCES_BATCH = """SELECT "references".obj_id, "references".type, "references".content
+FROM "references"
+WHERE "references".obj_id IN ({ids})
+ORDER BY "references".obj_id, "references".type, "references".content, "references".rowid"""
+
+DETAILS_CLASSIFIERS_BATCH = """SELECT objects_classifiers.obj_id, classifiers.name
+FROM objects_classifiers
+LEFT OUTER JOIN classifiers ON classifiers.id = objects_classifiers.cls_id
+WHERE objects_classifiers.obj_id IN ({ids})
+ORDER BY objects_classifiers.obj_id, objects_classifiers.cls_id, objects_classifiers.rowid"""
+
+DETAILS_PLACES_BATCH = """SELECT objects_places.obj_id, places.label
+FROM objects_places
+LEFT OUTER JOIN places ON objects_places.pl_id = places.id
+WHERE objects_places.obj_id IN ({ids})
+ORDER BY objects_places.obj_id, objects_places.pl_id, objects_places.rowid"""
@@ -0,0 +1,221 @@
+"""Module for generating synthetic lux databases, so the server can be benchmarked offline on
+collections of any size.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from contextlib import closing
+from sqlite3 import connect, Error
+
+SCHEMA = """
+CREATE TABLE objects(id INTEGER PRIMARY KEY, label TEXT, date TEXT, accession_no TEXT);
+CREATE TABLE agents(id INTEGER PRIMARY KEY, name TEXT, begin_date TEXT, end_date TEXT);
+CREATE TABLE productions(obj_id INTEGER, agt_id INTEGER, part TEXT);
+CREATE TABLE nationalities(id INTEGER PRIMARY KEY, descriptor TEXT);
+CREATE TABLE agents_nationalities(agt_id INTEGER, nat_id INTEGER);
+CREATE TABLE "references"(id INTEGER PRIMARY KEY, obj_id INTEGER, type TEXT, content TEXT);
+CREATE TABLE classifiers(id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE objects_classifiers(obj_id INTEGER, cls_id INTEGER);
+CREATE TABLE places(id INTEGER PRIMARY KEY, label TEXT);
+CREATE TABLE objects_places(obj_id INTEGER, pl_id INTEGER);
+CREATE TABLE departments(id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE objects_departments(obj_id INTEGER, dep_id INTEGER);
+"""
+
+# rows of each table in a collection of scale 1; --like takes them from a real database instead
+COLLECTION_SIZE = {
+    "objects": 5000,
+    "agents": 1500,
+    "productions": 6000,
+    "nationalities": 60,
+    "agents_nationalities": 1500,
+    "references": 7000,
+    "classifiers": 40,
+    "objects_classifiers": 6500,
+    "places": 300,
+    "objects_places": 4000,
+    "departments": 12,
+    "objects_departments": 5000,
+}
+
+# tables whose rows do not grow with the collection, like the list of departments
+FIXED_TABLES = ("nationalities", "classifiers", "departments")
+
+WORDS = ("portrait", "landscape", "river", "bowl", "vase", "mask", "coin", "print", "study",
+         "ship", "head", "figure", "jar", "plate", "garden", "woman", "man", "horse", "tree",
+         "church", "harbor", "still", "life", "night", "morning", "saint", "king", "queen",
+         "temple", "mountain", "bridge", "Étude", "Nocturne", "Madonna", "cup", "fragment")
+GIVEN_NAMES = ("John", "Mary", "Thomas", "Anne", "Pieter", "Jean", "Katsushika", "Utagawa",
+               "Maria", "William", "Elizabeth", "Louis", "Henri", "Giovanni", "Clara", "Frans")
+FAMILY_NAMES = ("Smith", "Trumbull", "Copley", "Hokusai", "Hiroshige", "Rembrandt", "Vermeer",
+                "Cassatt", "Homer", "Sargent", "Whistler", "Bellini", "Hals", "Monet", "Degas",
+                "Stuart", "Peale", "West", "Eakins", "Kahlo")
+# parts and reference types are never null in the collection, and every object has a reference
+PARTS = ("artist", "maker", "printer", "publisher", "designer", "engraver", "after")
+REFERENCE_TYPES = ("inscription", "signature", "note", "provenance", "exhibition")
+CLASSIFIER_WORDS = ("Paintings", "Prints", "Drawings", "Sculpture", "Coins", "Ceramics",
+                    "Photographs", "Textiles", "Furniture", "Manuscripts", "Metalwork", "Glass")
+DEPARTMENT_WORDS = ("American", "European", "Asian", "African", "Ancient", "Modern", "Islamic",
+                    "Numismatics", "Prints", "Photography")
+
+
+def collection_size(db_file):
+    """Counts the rows of the tables of a lux database.
+
+    Args:
+        db_file (str): database to measure
+
+    Return:
+        dict: number of rows of each table of COLLECTION_SIZE
+    """
+
+    with connect(db_file) as connection:
+        with closing(connection.cursor()) as cursor:
+            return {table: cursor.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+                    for table in COLLECTION_SIZE}
+
+
+def scaled_size(base_size, scale):
+    """Returns the rows of each table of a collection scale times the size of base_size."""
+
+    return {table: rows if table in FIXED_TABLES else max(1, round(rows * scale))
+            for table, rows in base_size.items()}
+
+
+def random_date(rng, first_year, last_year):
+    """Returns a date in the format of the agents table."""
+
+    year = rng.randint(first_year, last_year)
+    return f"{year:04d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def object_rows(rng, count):
+    """Generates rows of objects: labels of a few words, dates in the free forms of the
+    collection, and null labels and dates now and then.
+    """
+
+    for obj_id in range(1, count + 1):
+        label = " ".join(rng.sample(WORDS, rng.randint(1, 4))).capitalize()
+        year = rng.randint(-500, 2020)
+        date = rng.choice((str(year), f"ca. {year}", f"{year}–{year + rng.randint(1, 30)}",
+                           f"{abs(year)} B.C." if year < 0 else f"{year // 100 + 1}th century"))
+        yield (obj_id, rng.choice((label,) * 19 + (None,)),
+               rng.choice((date,) * 9 + (None,)), f"{obj_id:04d}.{rng.randint(1, 99)}")
+
+
+def agent_rows(rng, count):
+    """Generates rows of agents, some of them without a begin or end date."""
+
+    for agt_id in range(1, count + 1):
+        name = f"{rng.choice(GIVEN_NAMES)} {rng.choice(FAMILY_NAMES)}"
+        if rng.random() < 0.1:
+            name += f" {rng.choice(FAMILY_NAMES)}"
+        begin_year = rng.randint(1400, 1990)
+        yield (agt_id, name,
+               random_date(rng, begin_year, begin_year) if rng.random() < 0.8 else None,
+               random_date(rng, begin_year + 20, begin_year + 90) if rng.random() < 0.6 else None)
+
+
+def link_rows(rng, count, left_count, right_count, values=(), cover=False):
+    """Generates rows of a table that links two tables by their ids, with a random value
+    from each of values appended to each row. If cover is set, every left id has a row.
+    """
+
+    for index in range(max(count, left_count) if cover else count):
+        yield (index + 1 if cover and index < left_count else rng.randint(1, left_count),
+               rng.randint(1, right_count), *(rng.choice(choices) for choices in values))
+
+
+def generate(db_file, size, seed=0):
+    """Creates a synthetic lux database.
+
+    Args:
+        db_file (str): file of the new database, which must not exist
+        size (dict): number of rows of each table of COLLECTION_SIZE
+        seed (int): seed of the random generator, the same seed gives the same database
+    """
+
+    if os.path.exists(db_file):
+        raise FileExistsError(f"{db_file} already exists")
+
+    rng = random.Random(seed)
+    with closing(connect(db_file)) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.executescript(SCHEMA)
+            cursor.executemany("INSERT INTO objects VALUES (?, ?, ?, ?)",
+                               object_rows(rng, size["objects"]))
+            cursor.executemany("INSERT INTO agents VALUES (?, ?, ?, ?)",
+                               agent_rows(rng, size["agents"]))
+            cursor.executemany("INSERT INTO productions VALUES (?, ?, ?)",
+                               link_rows(rng, size["productions"], size["objects"],
+                                         size["agents"], (PARTS,)))
+            cursor.executemany("INSERT INTO nationalities VALUES (?, ?)",
+                               ((nat_id, f"{rng.choice(WORDS).capitalize()}ian")
+                                for nat_id in range(1, size["nationalities"] + 1)))
+            cursor.executemany("INSERT INTO agents_nationalities VALUES (?, ?)",
+                               link_rows(rng, size["agents_nationalities"], size["agents"],
+                                         size["nationalities"]))
+            cursor.executemany('INSERT INTO "references"(obj_id, type, content) VALUES (?, ?, ?)',
+                               ((obj_id, ref_type, f"{rng.choice(WORDS)} {content}")
+                                for obj_id, content, ref_type in link_rows(
+                                    rng, size["references"], size["objects"], 10 ** 6,
+                                    (REFERENCE_TYPES,), cover=True)))
+            cursor.executemany("INSERT INTO classifiers VALUES (?, ?)",
+                               ((cls_id, CLASSIFIER_WORDS[cls_id % len(CLASSIFIER_WORDS)]
+                                 + (f" {cls_id}" if cls_id > len(CLASSIFIER_WORDS) else ""))
+                                for cls_id in range(1, size["classifiers"] + 1)))
+            cursor.executemany("INSERT INTO objects_classifiers VALUES (?, ?)",
+                               link_rows(rng, size["objects_classifiers"], size["objects"],
+                                         size["classifiers"]))
+            cursor.executemany("INSERT INTO places VALUES (?, ?)",
+                               ((pl_id, f"{rng.choice(FAMILY_NAMES)} {rng.choice(WORDS)}")
+                                for pl_id in range(1, size["places"] + 1)))
+            cursor.executemany("INSERT INTO objects_places VALUES (?, ?)",
+                               link_rows(rng, size["objects_places"], size["objects"],
+                                         size["places"]))
+            cursor.executemany("INSERT INTO departments VALUES (?, ?)",
+                               ((dep_id, f"{DEPARTMENT_WORDS[dep_id % len(DEPARTMENT_WORDS)]} Art"
+                                 + (f" {dep_id}" if dep_id > len(DEPARTMENT_WORDS) else ""))
+                                for dep_id in range(1, size["departments"] + 1)))
+            cursor.executemany("INSERT INTO objects_departments VALUES (?, ?)",
+                               link_rows(rng, size["objects_departments"], size["objects"],
+                                         size["departments"]))
+        connection.commit()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog='lux_synth.py', allow_abbrev=False,
+        description='Generate a synthetic database for benchmarking the YUAG server')
+
+    parser.add_argument(
+        "db_file", help="the database file to create")
+
+    parser.add_argument(
+        "--scale", type=float, default=1,
+        help="the size of the collection relative to the base collection")
+
+    parser.add_argument(
+        "--like", default=None,
+        help="a lux database whose table sizes make the base collection")
+
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="the seed of the random generator")
+
+    args = parser.parse_args()
+
+    if args.scale <= 0:
+        print("error: scale must be positive", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        base = collection_size(args.like) if args.like else COLLECTION_SIZE
+        generate(args.db_file, scaled_size(base, args.scale), args.seed)
+    except (Error, OSError) as err:
+        print(f"error: {err}", file=sys.stderr)
+        sys.exit(1)
@@ -1,35 +1,517 @@
 """Module for creating a server connection for the database"""
 
 import argparse
+import asyncio
+import multiprocessing
+import selectors
 import sqlite3
 import json
 import sys
+import threading
+import time
 
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import closing
-from socket import socket, SOL_SOCKET, SO_REUSEADDR
-from os import name
+from queue import Empty, SimpleQueue
+from socket import (socket, socketpair, IPPROTO_TCP, SOL_SOCKET, SO_REUSEADDR,
+                    TCP_NODELAY)
+from os import name, cpu_count
+from types import SimpleNamespace
 
-from query import LuxDetailsQuery, LuxQuery, NoSearchResultsError
+from connection_pool import ConnectionPool
+from query import (DETAILS_ENGINES, MAX_SEARCH_ROWS, SEARCH_MODES, InvalidCursorError,
+                   LuxDetailsQuery, LuxQuery, NoSearchResultsError)
+from request_timing import LatencyHistograms, RequestTimer, SlowQueryLog
+from result_cache import ResultCache
+import wire_format
 
 
 DB_NAME = "./lux.sqlite"
 
+# "single" answers one request at a time, "thread" and "process" answer requests concurrently,
+# "asyncio" multiplexes all clients on one event loop and runs the queries on worker threads
+SERVER_MODES = ("single", "thread", "process", "asyncio")
+DEFAULT_MODE = "thread"
+DEFAULT_WORKERS = min(32, (cpu_count() or 1) + 4)
+DEFAULT_BACKLOG = 128
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_SEARCH_MODE = "materialized"
+DEFAULT_DETAILS_ENGINE = "relations"
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_DETAILS_CACHE_BYTES = 16 * 1024 * 1024
+MAX_DETAILS_BATCH = 100
+DEFAULT_SLOW_THRESHOLD_MS = 200
+
+# bytes read from a client socket at once
+READ_SIZE = 65536
+
+# the RequestHandler of this process, kept for the lifetime of the server
+# (worker processes create their own on first use)
+_process_state = SimpleNamespace(handler=None)
+
+
+class RequestHandler():
+    """Class that answers decoded client requests using a pool of read-only connections.
+    A single RequestHandler is shared by every worker thread of a process.
+    """
+
+    def __init__(self, pool, search_mode=DEFAULT_SEARCH_MODE, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_ttl=None, details_cache_bytes=DEFAULT_DETAILS_CACHE_BYTES,
+                 access_log=None, warm_details=0, details_engine=DEFAULT_DETAILS_ENGINE):
+        """Creates the query objects that borrow their connections from the pool
+        and the caches of search and details responses.
+
+        Args:
+            pool (ConnectionPool): pool of connections to the database
+            search_mode (str): one of query.SEARCH_MODES
+            cache_size (int): number of search responses to cache, 0 disables the cache
+            cache_ttl (float): seconds a cached search response stays valid, forever if None
+            details_cache_bytes (int): bytes of details responses to cache, 0 disables the cache
+            access_log (str): file that records the id of every details request (optional)
+            warm_details (int): number of most requested ids in access_log to cache up front
+            details_engine (str): one of query.DETAILS_ENGINES
+        """
+
+        self._query_by_id = LuxDetailsQuery(pool.db_file, pool=pool, engine=details_engine)
+        self._query_by_filter = LuxQuery(pool.db_file, pool=pool, search_mode=search_mode)
+        self._search_cache = ResultCache(pool.db_file, max_entries=cache_size, ttl=cache_ttl)
+        self._details_cache = ResultCache(pool.db_file, max_bytes=details_cache_bytes)
+
+        self._access_log = None
+        self._access_log_lock = threading.Lock()
+        if access_log:
+            if warm_details > 0:
+                self.warm_details_cache(access_log, warm_details)
+            self._access_log = open(access_log, 'a', encoding='utf-8')
+
+    def handle(self, request):
+        """Query the database with the given request.
+
+        If id is given, then we query by id otherwise we query by the filter:
+        (agt, dep, classifers, lebel). A request with type "stats" gets the cache counters
+        (to which the Server adds its latency histograms).
+        A query by filter with stream set gets its response as a generator of json frames.
+        A query by filter with page_size set is paged, cursor asks for the page after the one
+        that returned it as next_cursor. encoding and compression ask for a compact encoding
+        of a query by filter (see wire_format). A request with ids gets the details of several
+        objects.
+
+        Args:
+            request (dict): request read from the client
+
+        Return:
+            tuple: response for the client (str or generator of str)
+            and a message for the server log
+        """
+
+        # query the database by id if given otherwise by filters
+        try:
+            if request.get('type') == 'stats':
+                response = json.dumps({"search_cache": self._search_cache.stats(),
+                                       "details_cache": self._details_cache.stats()}) + "\n"
+                client_response = "Wrote to client: stats"
+            elif request.get('ids') is not None:
+                response, client_response = self.handle_details_batch(request['ids'])
+            elif request['id']:
+                response, client_response = self.handle_details(request['id'])
+            elif request.get('stream'):
+                response = self.stream_search(request)
+                client_response = "Wrote to client: query by filter (streamed) "
+            else:
+                response, client_response = self.handle_search(request)
+        except NoSearchResultsError:
+            response = "Invalid id\n"
+            client_response = "\nWrote to client: invalid id\n"
+        except InvalidCursorError:
+            response = "Invalid cursor\n"
+            client_response = "Wrote to client: invalid cursor\n"
+        except sqlite3.Error as err:
+            response = str(err) + "\n"
+            client_response = f"Wrote to client: {err}\n"
+        except Exception as err:
+            response = str(err) + "\n"
+            client_response = f"Wrote to client: {err}\n"
+
+        return response, client_response
+
+    def handle_details(self, obj_id):
+        """Answers a query by id from the cache, or queries the database and caches
+        the response. Records the id in the access log.
+
+        Args:
+            obj_id: id of the object
+
+        Return:
+            tuple: response for the client and a message for the server log
+        """
+
+        if self._access_log is not None:
+            with self._access_log_lock:
+                self._access_log.write(f"{obj_id}\n")
+                self._access_log.flush()
+
+        response = self._details_cache.get(str(obj_id))
+        if response is not None:
+            return response, "Wrote to client: query by id (cached)"
+
+        response = self._query_by_id.search(obj_id) + "\n"
+        self._details_cache.put(str(obj_id), response)
+        return response, "Wrote to client: query by id"
+
+    def handle_details_batch(self, obj_ids):
+        """Answers a batch of queries by id in one response, from the cache where possible and
+        with one batch query for the rest. The ids are not recorded in the access log, since
+        batches are prefetched rather than asked for by the user.
+
+        Args:
+            obj_ids (list): ids of the objects
+
+        Return:
+            tuple: response for the client and a message for the server log
+        """
+
+        if not isinstance(obj_ids, list) or len(obj_ids) > MAX_DETAILS_BATCH:
+            raise ValueError(f"ids must be a list of at most {MAX_DETAILS_BATCH} ids")
+
+        # the details cache is keyed by str of the id, so are the details in the response
+        obj_ids = list(dict.fromkeys(str(obj_id) for obj_id in obj_ids))
+
+        responses = {}
+        for obj_id in obj_ids:
+            response = self._details_cache.get(obj_id)
+            if response is not None:
+                responses[obj_id] = response
+
+        missing = [obj_id for obj_id in obj_ids if obj_id not in responses]
+        if missing:
+            for obj_id, response in self._query_by_id.search_batch(missing).items():
+                responses[obj_id] = response + "\n"
+                self._details_cache.put(obj_id, response + "\n")
+
+        # the cached responses are json already, so they are spliced in as they are;
+        # an object that does not exist gets null
+        details = ", ".join(f"{json.dumps(obj_id)}: {responses.get(obj_id, 'null').rstrip()}"
+                            for obj_id in obj_ids)
+        return '{"details": {' + details + '}}\n', \
+            f"Wrote to client: query by ids ({len(obj_ids) - len(missing)} cached)"
+
+    def warm_details_cache(self, access_log, count):
+        """Caches the details responses of the most requested ids in an access log.
+        Ids that no longer exist are skipped.
+
+        Args:
+            access_log (str): file with one requested id per line
+            count (int): number of ids to cache
+        """
+
+        try:
+            with open(access_log, encoding='utf-8') as log_file:
+                requested = Counter(line.strip() for line in log_file if line.strip())
+        except FileNotFoundError:
+            return
+
+        for obj_id, _ in requested.most_common(count):
+            try:
+                self._details_cache.put(obj_id, self._query_by_id.search(obj_id) + "\n")
+            except NoSearchResultsError:
+                pass
+
+    def stream_search(self, request):
+        """Streams the frames of a search by filter. An error while searching ends the stream
+        with an error frame, since frames may have been written already.
+
+        Args:
+            request (dict): request read from the client
+
+        Return:
+            generator of str: json frames
+        """
+
+        try:
+            page_size, page_cursor = search_page(request)
+            encoding, compression = request.get('encoding'), request.get('compression')
+            wire_format.check_encoding(encoding, compression)
+            yield from self._query_by_filter.search_stream(
+                agt=request['agt'], dep=request['dep'], classifier=request['classifier'],
+                label=request['label'], page_size=page_size, page_cursor=page_cursor,
+                encoding=encoding, compression=compression)
+        except InvalidCursorError:
+            yield json.dumps({"frame": "error", "message": "Invalid cursor"}) + "\n"
+        except Exception as err:
+            yield json.dumps({"frame": "error", "message": str(err)}) + "\n"
+
+    def handle_search(self, request):
+        """Answers a search by filter from the cache, or queries the database and caches
+        the response.
+
+        Args:
+            request (dict): request read from the client
+
+        Return:
+            tuple: response for the client and a message for the server log
+        """
+
+        page_size, page_cursor = search_page(request)
+        encoding, compression = request.get('encoding'), request.get('compression')
+        wire_format.check_encoding(encoding, compression)
+
+        # empty filters are the same as missing ones
+        cache_key = tuple(request[key] or None for key in ('label', 'classifier', 'agt', 'dep'))
+        cache_key += (page_size, page_cursor, encoding or "text", compression)
+
+        response = self._search_cache.get(cache_key)
+        if response is not None:
+            return response, "Wrote to client: query by filter (cached) "
+
+        response = self._query_by_filter.search(agt=request['agt'], dep=request['dep'],
+                                                classifier=request['classifier'],
+                                                label=request['label'], page_size=page_size,
+                                                page_cursor=page_cursor, encoding=encoding,
+                                                compression=compression) + "\n"
+        self._search_cache.put(cache_key, response)
+        return response, "Wrote to client: query by filter "
+
+
+def search_page(request):
+    """Reads the paging fields of a search request.
+
+    Args:
+        request (dict): request read from the client
+
+    Return:
+        tuple: page_size (None if the search is not paged) and cursor (None for the first page)
+    """
+
+    page_size = request.get('page_size')
+    if page_size is not None and (not isinstance(page_size, int) or isinstance(page_size, bool)
+                                  or not 1 <= page_size <= MAX_SEARCH_ROWS):
+        raise ValueError(f"page_size must be an integer from 1 to {MAX_SEARCH_ROWS}")
+    return page_size, request.get('cursor') or None
+
+
+def session_envelope(request):
+    """Creates the line that precedes the response to a request of a session, so the client
+    can tell which request the lines that follow answer.
+
+    Args:
+        request (dict): request read from the client
+
+    Return:
+        str: json line with the request_id of the request
+    """
+
+    return json.dumps({"request_id": request.get('request_id')}) + "\n"
+
+
+def request_kind(request):
+    """Names the kind of a request, in the order in which RequestHandler.handle tells them apart.
+
+    Args:
+        request (dict): request read from the client
+
+    Return:
+        str: stats, details_batch, details, search_stream or search
+    """
+
+    if request.get('type') == 'stats':
+        return "stats"
+    if request.get('ids') is not None:
+        return "details_batch"
+    if request.get('id'):
+        return "details"
+    if request.get('stream'):
+        return "search_stream"
+    return "search"
+
+
+def init_handler(db_file, pool_size, handler_options):
+    """Opens the connection pool of this process and creates its RequestHandler.
+
+    Args:
+        db_file (str): database file
+        pool_size (int): number of connections to keep open
+        handler_options (dict): keyword arguments for RequestHandler
+    """
+
+    _process_state.handler = RequestHandler(ConnectionPool(db_file, pool_size),
+                                            **handler_options)
+
+
+def handle_request(request, materialize=False):
+    """Answers a request with the RequestHandler of this process.
+    This is a module level function so that it can be submitted to a process pool,
+    whose worker processes each open a single connection on their first request.
+
+    Args:
+        request (dict): request read from the client
+        materialize (bool): turn streamed responses into lists of frames, which unlike
+            generators can be sent back from a worker process
+
+    Return:
+        tuple: response for the client and a message for the server log
+    """
+
+    if _process_state.handler is None:
+        try:
+            init_handler(DB_NAME, 1, {})
+        except sqlite3.Error as err:
+            return str(err) + "\n", f"Wrote to client: {err}\n"
+
+    response, client_response = _process_state.handler.handle(request)
+    if materialize and not isinstance(response, str):
+        response = list(response)
+    return response, client_response
+
+
+def handle_timed_request(request):
+    """Answers a request in a worker process like handle_request does, timing it there.
+
+    Args:
+        request (dict): request read from the client
+
+    Return:
+        tuple: response for the client, a message for the server log and the RequestTimer
+        with the phases spent in the worker process
+    """
+
+    timer = RequestTimer()
+    response, client_response = timer.run(handle_request, request, True)
+    return response, client_response, timer
+
+
+class ClientConnection():
+    """Class for the connection to a client, which outlives the handling of each of its
+    requests: between them it waits in the selector of the Server, not in a worker thread.
+    Requests are read from a buffer of its own, so that the Server can tell whether the next
+    one has already been read.
+    """
+
+    def __init__(self, sock, client_addr):
+        """Wraps an accepted socket.
+
+        Args:
+            sock: socket accepted from server_sock
+            client_addr: address of the client
+        """
+
+        self.sock = sock
+        # responses are flushed frame by frame: send each one at once rather than waiting
+        # for the client to acknowledge the previous one (Nagle's algorithm)
+        self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.client_addr = client_addr
+        self.out_flo = sock.makefile(mode='w', encoding='utf-8')
+        self.session = False
+        self.idle_since = time.monotonic()
+        self._buffer = bytearray()
+
+    def has_request(self):
+        """Returns whether a whole request has already been read from the socket."""
+
+        return b"\n" in self._buffer
+
+    def readline(self):
+        """Reads the next request, waiting for the rest of it if it is not whole yet.
+
+        Return:
+            str: the request line, '' if the client closed the connection
+        """
+
+        while b"\n" not in self._buffer:
+            chunk = self.sock.recv(READ_SIZE)
+            if not chunk:
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                return line.decode('utf-8')
+            self._buffer += chunk
+
+        end = self._buffer.index(b"\n") + 1
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line.decode('utf-8')
+
+    def close(self):
+        """Closes the socket."""
+
+        for closeable in (self.out_flo, self.sock):
+            try:
+                closeable.close()
+            except OSError:
+                pass
+
 
 class Server():
     """Class that represents a server connection that query the database"""
 
-    def __init__(self, server_port):
+    def __init__(self, server_port, mode=DEFAULT_MODE, workers=DEFAULT_WORKERS,
+                 backlog=DEFAULT_BACKLOG, idle_timeout=DEFAULT_IDLE_TIMEOUT, slow_log=None,
+                 slow_threshold_ms=DEFAULT_SLOW_THRESHOLD_MS, **handler_options):
         """Initalizes the server with the port being given and call a function to open the socket
         and start listening.
 
         Args:
             port (int): port for server
+            mode (str): one of SERVER_MODES
+            workers (int): number of worker threads or processes
+            backlog (int): number of pending connections the socket queues up
+            idle_timeout (float): seconds a session may wait for its next request
+            slow_log (str): file that records the requests slower than slow_threshold_ms,
+                with their query plans (optional)
+            slow_threshold_ms (float): milliseconds a request must exceed to be slow
+            handler_options: keyword arguments for RequestHandler
 
         """
 
         self._port = server_port
+        self._mode = mode
+        self._workers = workers
+        self._backlog = backlog
+        self._idle_timeout = idle_timeout
+        self._handler_options = handler_options
+        self._query_pool = None
+        self._stream_slots = None
+        self._waiting = SimpleQueue()
+        self._wake_sock = None
+        self._latency = LatencyHistograms()
+        self._slow_log = None
+        if slow_log:
+            self._slow_log = SlowQueryLog(DB_NAME, slow_log, slow_threshold_ms / 1000)
         self.open_socket()
 
+    def add_latency(self, request, response):
+        """Adds the latency histograms to the response to a stats request.
+
+        Args:
+            request (dict): request read from the client
+            response: response of the RequestHandler
+
+        Return:
+            the response, with the histograms if it answers a stats request
+        """
+
+        if request_kind(request) != "stats" or not response.startswith("{"):
+            return response
+        return json.dumps(dict(json.loads(response), latency=self._latency.stats())) + "\n"
+
+    def finish_request(self, request, timer):
+        """Counts a request that has been answered in the latency histograms, logs its timing
+        and, if it was slow, records it in the slow query log.
+
+        Args:
+            request (dict): request read from the client
+            timer (RequestTimer): timer of the request
+        """
+
+        total = timer.total()
+        kind = request_kind(request)
+        self._latency.add(kind, timer, total)
+        print(f"Answered {kind} in {timer.summary(total)}")
+        if self._slow_log is not None:
+            try:
+                self._slow_log.log(kind, request, timer, total)
+            except OSError as ex:
+                print(ex, file=sys.stderr)
+
     def open_socket(self):
         """Open the socket, bind to the port and starts listening on the port"""
 
@@ -39,7 +521,7 @@ class Server():
             if name != 'nt':
                 server_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
                 server_sock.bind(('', self._port))
-                server_sock.listen()
+                server_sock.listen(self._backlog)
 
             self.handle_connection(server_sock)
         except Exception as ex:
@@ -47,76 +529,357 @@ class Server():
             sys.exit(1)
 
     def handle_connection(self, server_sock):
-        """Takes in a socket and accept a connection to the server and calls a function
-        that handles the communication between server and client.
+        """Takes in a socket and accept connections to the server. In single mode each request
+        is answered before the next one is read, otherwise requests are handed to a pool of
+        worker threads. In process mode those threads pass the queries on to worker processes.
+
+        Args:
+            server_sock: server socket
+        """
+
+        if self._mode == "single":
+            init_handler(DB_NAME, 1, self._handler_options)
+            self.accept_clients(server_sock, None)
+            return
+
+        if self._mode == "process":
+            # fail at startup if the database cannot be opened, like the other modes do
+            ConnectionPool(DB_NAME, 1).close()
+            # spawn rather than fork, so that worker processes do not inherit client sockets
+            self._query_pool = ProcessPoolExecutor(
+                max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_handler, initargs=(DB_NAME, 1, self._handler_options))
+        else:
+            init_handler(DB_NAME, self._workers, self._handler_options)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers) as client_pool:
+                self.accept_clients(server_sock, client_pool)
+        finally:
+            if self._query_pool is not None:
+                self._query_pool.shutdown(cancel_futures=True)
+
+    def accept_clients(self, server_sock, client_pool):
+        """Accept connections forever and wait for their requests with a selector, so that
+        a connection only takes a worker while one of its requests is answered: idle sessions
+        cannot starve the other clients. A connection with a request is served inline if
+        client_pool is None. Sessions idle for idle_timeout seconds are closed.
 
         Args:
             server_sock: server socket
+            client_pool (ThreadPoolExecutor): pool that serves the requests
+        """
+
+        wake_sock, self._wake_sock = socketpair()
+        wake_sock.setblocking(False)
+        self._wake_sock.setblocking(False)
+
+        with selectors.DefaultSelector() as selector, closing(wake_sock), \
+                closing(self._wake_sock):
+            selector.register(server_sock, selectors.EVENT_READ)
+            selector.register(wake_sock, selectors.EVENT_READ)
+
+            while True:
+                try:
+                    for key, _ in selector.select(self.select_timeout(selector)):
+                        if key.fileobj is server_sock:
+                            sock, client_addr = server_sock.accept()
+                            print('Server IP address and port:', sock.getsockname())
+                            print('Client IP address and port:', client_addr)
+                            self.wait_for_request(selector, ClientConnection(sock, client_addr))
+                        elif key.fileobj is wake_sock:
+                            self.take_back_connections(selector, wake_sock)
+                        else:
+                            selector.unregister(key.fileobj)
+                            if client_pool is None:
+                                self.serve_client(key.data)
+                            else:
+                                client_pool.submit(self.serve_client, key.data)
+                    self.close_idle_sessions(selector)
+                except Exception as ex:
+                    print(ex, file=sys.stderr)
+
+    def wait_for_request(self, selector, conn):
+        """Registers a connection with the selector until its next request arrives.
+
+        Args:
+            selector (selectors.BaseSelector): selector of accept_clients
+            conn (ClientConnection): connection between two requests
+        """
+
+        conn.idle_since = time.monotonic()
+        try:
+            selector.register(conn.sock, selectors.EVENT_READ, conn)
+        except (OSError, ValueError) as ex:
+            print(ex, file=sys.stderr)
+            conn.close()
+
+    def take_back_connections(self, selector, wake_sock):
+        """Registers the sessions that worker threads have handed back with the selector.
+
+        Args:
+            selector (selectors.BaseSelector): selector of accept_clients
+            wake_sock: socket that the worker threads write to when they hand one back
         """
 
-        # accept the connection and calls handle_client
+        try:
+            while wake_sock.recv(READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
         while True:
             try:
-                sock, client_addr = server_sock.accept()
-                with closing(sock):
-                    print('Server IP address and port:', sock.getsockname())
-                    print('Client IP address and port:', client_addr)
-                    self.handle_client(sock)
-            except Exception as ex:
-                print(ex, file=sys.stderr)
+                conn = self._waiting.get_nowait()
+            except Empty:
+                return
+            self.wait_for_request(selector, conn)
+
+    def select_timeout(self, selector):
+        """Returns the seconds until the first idle session times out, None if none waits."""
+
+        idle_since = [key.data.idle_since for key in selector.get_map().values()
+                      if key.data is not None and key.data.session]
+        if not idle_since:
+            return None
+        return max(0, min(idle_since) + self._idle_timeout - time.monotonic())
+
+    def close_idle_sessions(self, selector):
+        """Closes the sessions that waited for their next request for idle_timeout seconds."""
+
+        now = time.monotonic()
+        idle = [key.data for key in selector.get_map().values()
+                if key.data is not None and key.data.session
+                and now - key.data.idle_since >= self._idle_timeout]
+        for conn in idle:
+            selector.unregister(conn.sock)
+            conn.close()
+            print('Closed idle session')
+
+    def serve_client(self, conn):
+        """Answers the requests of a client that have arrived, then hands the connection of a
+        session back to the selector for its next request, and closes any other.
 
-    def handle_client(self, sock):
-        """Takes in a sock, read the input from the client, query the database
+        Args:
+            conn (ClientConnection): connection with a request to read
+        """
+
+        try:
+            keep_open = self.handle_client(conn)
+        except Exception as ex:
+            print(ex, file=sys.stderr)
+            keep_open = False
+
+        if not keep_open:
+            conn.close()
+            return
+
+        self._waiting.put(conn)
+        try:
+            self._wake_sock.send(b"\0")
+        except BlockingIOError:
+            # the selector has yet to read the earlier wake ups, and takes this one with them
+            pass
+
+    def handle_client(self, conn):
+        """Read the requests of a client that have arrived, query the database
         with the given args and returns to the client the query results.
 
-        If id is given, then we query by id otherwise we query by the filter:
-        (agt, dep, classifers, lebel)
+        A request with session set keeps the connection open: the client may send more
+        requests on it, each answered after a session_envelope line, until it closes the
+        connection or stays idle for idle_timeout seconds.
 
         Args:
-            sock: sock from server_sock
+            conn (ClientConnection): connection with a request to read
+
+        Return:
+            bool: whether the connection is a session that waits for its next request
         """
 
-        query_by_id = LuxDetailsQuery(DB_NAME)
-        query_by_filter = LuxQuery(DB_NAME)
+        out_flo = conn.out_flo
 
-        # reads in from the client
-        in_flo = sock.makefile(mode='r', encoding='utf-8')
-        in_flo_input = in_flo.readline()
+        while True:
+            in_flo_input = conn.readline()
+
+            if in_flo_input == '':
+                if not conn.session:
+                    print('The lux client crashed')
+                return False
+
+            timer = RequestTimer()
+            with timer.phase("parse"):
+                in_flo_input = json.loads(in_flo_input)
+
+            print('\nRead from client id: ' + str(in_flo_input), end='\n')
+
+            with timer.active():
+                # query the database, in a worker process when running in process mode
+                if self._query_pool is not None:
+                    response, client_response, worker_timer = self._query_pool.submit(
+                        handle_timed_request, in_flo_input).result()
+                    timer.merge(worker_timer)
+                else:
+                    response, client_response = handle_request(in_flo_input)
+                response = self.add_latency(in_flo_input, response)
+
+                conn.session = conn.session or bool(in_flo_input.get('session'))
+                if conn.session:
+                    out_flo.write(session_envelope(in_flo_input))
+
+                # return the results of querying the database, frame by frame if streamed
+                if isinstance(response, str):
+                    with timer.phase("write"):
+                        out_flo.write(response)
+                elif isinstance(response, list):
+                    # frames that a worker process has already fetched
+                    with timer.phase("write"):
+                        out_flo.writelines(response)
+                else:
+                    with closing(response) as frames:
+                        for frame in frames:
+                            with timer.phase("write"):
+                                out_flo.write(frame)
+                                out_flo.flush()
+                with timer.phase("write"):
+                    out_flo.flush()
+
+            print(client_response + "\n", end="")
+            self.finish_request(in_flo_input, timer)
+
+            if not conn.session:
+                return False
+            if not conn.has_request():
+                return True
+
+
+class AsyncServer(Server):
+    """Class that represents a server connection built on asyncio streams. Socket I/O never
+    blocks, so idle or slow clients only cost a coroutine instead of a thread. It speaks the
+    same newline-delimited JSON protocol as Server.
+    """
 
-        if in_flo_input == '':
-            print('The lux client crashed')
-            return
+    def open_socket(self):
+        """Runs the event loop that binds to the port and starts listening on the port"""
+
+        try:
+            asyncio.run(self.serve())
+        except Exception as ex:
+            print(ex, file=sys.stderr)
+            sys.exit(1)
+
+    async def serve(self):
+        """Starts the asyncio server and serves clients until the process is stopped.
+        Queries run on a pool of worker threads so that the event loop never stalls.
 
-        in_flo_input = json.loads(in_flo_input)
+        A streamed search keeps its connection while it waits for a slow client, so at most
+        one stream per worker runs at a time and the connection pool is twice the number of
+        workers: the worker threads can then always get a connection.
+        """
 
-        print('\nRead from client id: ' + str(in_flo_input), end='\n')
+        init_handler(DB_NAME, 2 * self._workers, self._handler_options)
+        self._stream_slots = asyncio.Semaphore(self._workers)
+
+        with ThreadPoolExecutor(max_workers=self._workers) as query_pool:
+            async_server = await asyncio.start_server(
+                lambda reader, writer: self.handle_stream(reader, writer, query_pool),
+                port=self._port, backlog=self._backlog, reuse_address=name != 'nt')
+
+            async with async_server:
+                await async_server.serve_forever()
+
+    async def handle_stream(self, reader, writer, query_pool):
+        """Reads the requests of one client, queries the database on query_pool and writes
+        the results back to the client. Sessions work as in Server.handle_client.
+
+        Args:
+            reader (asyncio.StreamReader): stream from the client
+            writer (asyncio.StreamWriter): stream to the client
+            query_pool (ThreadPoolExecutor): pool that runs the queries
+        """
 
-        # query the database by id if given otherwise by filters
         try:
-            if in_flo_input['id']:
-                response = query_by_id.search(in_flo_input['id']) + "\n"
-                client_response = "Wrote to client: query by id"
-            else:
-                response = query_by_filter.search(agt=in_flo_input['agt'], dep=in_flo_input['dep'],
-                                                  classifier=in_flo_input['classifier'],
-                                                  label=in_flo_input['label'])
-                client_response = "Wrote to client: query by filter "
-        except NoSearchResultsError:
-            response = "Invalid id\n"
-            client_response = "\nWrote to client: invalid id\n"
-        except sqlite3.Error as err:
-            response = str(err) + "\n"
-            client_response = f"Wrote to client: {err}\n"
-        except Exception as err:
-            response = str(err) + "\n"
-            client_response = f"Wrote to client: {err}\n"
+            print('Server IP address and port:', writer.get_extra_info('sockname'))
+            print('Client IP address and port:', writer.get_extra_info('peername'))
+
+            session = False
+            while True:
+                try:
+                    in_flo_input = await asyncio.wait_for(
+                        reader.readline(), self._idle_timeout if session else None)
+                except asyncio.TimeoutError:
+                    print('Closed idle session')
+                    return
+                in_flo_input = in_flo_input.decode('utf-8')
+
+                if in_flo_input == '':
+                    if not session:
+                        print('The lux client crashed')
+                    return
+
+                timer = RequestTimer()
+                with timer.phase("parse"):
+                    in_flo_input = json.loads(in_flo_input)
+
+                print('\nRead from client id: ' + str(in_flo_input), end='\n')
+
+                session = session or bool(in_flo_input.get('session'))
+                if session:
+                    writer.write(session_envelope(in_flo_input).encode('utf-8'))
+
+                if in_flo_input.get('stream'):
+                    async with self._stream_slots:
+                        client_response = await self.write_frames(
+                            writer, in_flo_input, query_pool, timer)
+                else:
+                    response, client_response = await asyncio.get_running_loop(
+                        ).run_in_executor(query_pool, timer.run, handle_request, in_flo_input)
+                    response = self.add_latency(in_flo_input, response)
+
+                    # return the results of querying the database
+                    with timer.phase("write"):
+                        writer.write(response.encode('utf-8'))
+                        await writer.drain()
+
+                print(client_response + "\n", end="")
+                self.finish_request(in_flo_input, timer)
+
+                if not session:
+                    return
+        except Exception as ex:
+            print(ex, file=sys.stderr)
+        finally:
+            writer.close()
+
+    async def write_frames(self, writer, request, query_pool, timer):
+        """Answers a request whose response may be streamed, fetching each frame on query_pool
+        and writing it to the client as soon as it is ready.
+
+        Args:
+            writer (asyncio.StreamWriter): stream to the client
+            request (dict): request read from the client
+            query_pool (ThreadPoolExecutor): pool that runs the queries
+            timer (RequestTimer): timer of the request
+
+        Return:
+            str: message for the server log
+        """
 
-        # return the results of querying the database
-        out_flo = sock.makefile(mode='w', encoding='utf-8')
-        out_flo.write(response)
-        out_flo.flush()
+        loop = asyncio.get_running_loop()
+        response, client_response = await loop.run_in_executor(
+            query_pool, timer.run, handle_request, request)
 
-        print(client_response + "\n", end="")
+        if isinstance(response, str):
+            with timer.phase("write"):
+                writer.write(response.encode('utf-8'))
+                await writer.drain()
+            return client_response
+
+        with closing(iter(response)) as frames:
+            while (frame := await loop.run_in_executor(query_pool, timer.run, next, frames, None)):
+                with timer.phase("write"):
+                    writer.write(frame.encode('utf-8'))
+                    await writer.drain()
+        return client_response
 
 
 if __name__ == '__main__':
@@ -128,7 +891,68 @@ if __name__ == '__main__':
     parser.add_argument(
         "port", help="the port at which the server should listen",)
 
+    parser.add_argument(
+        "--mode", choices=SERVER_MODES, default=DEFAULT_MODE,
+        help="how clients are served: one at a time, by worker threads, by worker processes "
+        "or on an asyncio event loop")
+
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="the number of worker threads or processes")
+
+    parser.add_argument(
+        "--backlog", type=int, default=DEFAULT_BACKLOG,
+        help="the number of pending connections to queue up")
+
+    parser.add_argument(
+        "--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+        help="the seconds a keep-alive session may stay idle before the server closes it")
+
+    parser.add_argument(
+        "--search-mode", choices=SEARCH_MODES, default=DEFAULT_SEARCH_MODE,
+        help="cte: always run the full search query, materialized: use the search table "
+        "built by lux_db.py while it is up to date, fts: also use its full-text index")
+
+    parser.add_argument(
+        "--details-engine", choices=DETAILS_ENGINES, default=DEFAULT_DETAILS_ENGINE,
+        help="join: fetch object details with one join over all relations, "
+        "relations: with one query per relation")
+
+    parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+        help="the number of search responses to cache, 0 disables the cache")
+
+    parser.add_argument(
+        "--cache-ttl", type=float, default=None,
+        help="the number of seconds a cached search response stays valid")
+
+    parser.add_argument(
+        "--details-cache-bytes", type=int, default=DEFAULT_DETAILS_CACHE_BYTES,
+        help="the number of bytes of details responses to cache, 0 disables the cache")
+
+    parser.add_argument(
+        "--access-log", default=None,
+        help="a file that records the id of every details request")
+
+    parser.add_argument(
+        "--warm-details", type=int, default=0,
+        help="the number of most requested ids in the access log to cache at startup")
+
+    parser.add_argument(
+        "--slow-log", default=None,
+        help="a file that records the slow requests with the query plans of their statements")
+
+    parser.add_argument(
+        "--slow-threshold", type=float, default=DEFAULT_SLOW_THRESHOLD_MS,
+        help="the number of milliseconds after which a request is slow")
+
     args = parser.parse_args()
+
+    if (args.workers < 1 or args.backlog < 0 or args.idle_timeout <= 0
+            or args.slow_threshold < 0):
+        print("error: workers and idle timeout must be positive and backlog and slow "
+              "threshold must not be negative", file=sys.stderr)
+        sys.exit(1)
     port = args.port
 
     # make sure that port is valid
@@ -140,7 +964,14 @@ if __name__ == '__main__':
 
     # starts the server with the port
     try:
-        Server(port)
+        server_class = AsyncServer if args.mode == "asyncio" else Server
+        server_class(port, mode=args.mode, workers=args.workers, backlog=args.backlog,
+                     idle_timeout=args.idle_timeout, slow_log=args.slow_log,
+                     slow_threshold_ms=args.slow_threshold,
+                     search_mode=args.search_mode, cache_size=args.cache_size,
+                     cache_ttl=args.cache_ttl, details_cache_bytes=args.details_cache_bytes,
+                     access_log=args.access_log, warm_details=args.warm_details,
+                     details_engine=args.details_engine)
     except Exception as err_message:
         print("The server has crashed, error: ", err_message, file=sys.stderr)
         sys.exit(1)
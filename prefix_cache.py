@@ -0,0 +1,117 @@
+"""Module for the client-side cache that answers refined searches without the server."""
+
+import re
+import time
+
+from collections import OrderedDict
+
+# index in a row of the search response of the column each filter is matched against
+# (the department is not part of the row, so it can only be reused as is)
+FILTER_ROW_INDEX = {"label": 1, "agt": 3, "classifier": 4}
+FILTERS = ("label", "classifier", "agt", "dep")
+
+
+def like_pattern(term):
+    """Compiles the regular expression matching the values that LIKE '%term%' matches in
+    SQLite: '%' and '_' are wildcards and only ASCII letters are case-insensitive.
+
+    Args:
+        term (str): filter as typed by the user
+
+    Return:
+        re.Pattern: pattern to search values with
+    """
+
+    pattern = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char)
+                      for char in term)
+    return re.compile(pattern, re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+class PrefixCache():
+    """Class for an LRU cache of complete search results, each kept for ttl seconds.
+
+    A search whose filters each contain the filter of a cached search (for instance the
+    cached label "bo" and the new label "bow") matches a subset of the cached rows, so its
+    rows are found by filtering the cached rows. The rows keep their order as long as the
+    server would sort both searches the same way, which depends on which of agt and
+    classifier are given (see LuxQuery.search_statement).
+    """
+
+    def __init__(self, max_entries, ttl):
+        """Initalizes an empty cache.
+
+        Args:
+            max_entries (int): number of searches kept before the least recently used is evicted
+            ttl (float): seconds a search stays valid
+        """
+
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+
+    def put(self, filters, columns, rows):
+        """Caches the complete result of a search.
+
+        Args:
+            filters (dict): label, classifier, agt and dep of the search, None if not given
+            columns (list): columns of the response
+            rows (list): every row of the search
+        """
+
+        key = tuple(filters[name] for name in FILTERS)
+        self._entries[key] = (columns, rows, time.monotonic() + self._ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, filters):
+        """Returns the result of a search from the smallest cached search it refines,
+        or None if there is none.
+
+        Args:
+            filters (dict): label, classifier, agt and dep of the search, None if not given
+
+        Return:
+            tuple: columns and rows of the search
+        """
+
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[2] < now]:
+            del self._entries[key]
+
+        candidates = [key for key in self._entries
+                      if self._refines(filters, dict(zip(FILTERS, key)))]
+        if not candidates:
+            return None
+
+        key = min(candidates, key=lambda key: len(self._entries[key][1]))
+        self._entries.move_to_end(key)
+        columns, rows, _ = self._entries[key]
+        cached = dict(zip(FILTERS, key))
+
+        # only the filters that changed can drop cached rows
+        patterns = [(index, like_pattern(filters[name]))
+                    for name, index in FILTER_ROW_INDEX.items() if filters[name] != cached[name]]
+        return columns, [row for row in rows
+                         if all(row[index] is not None and pattern.search(str(row[index]))
+                                for index, pattern in patterns)]
+
+    def _refines(self, filters, cached):
+        """Returns true iff the rows of the search are the cached rows that also match filters,
+        in the same order.
+
+        Args:
+            filters (dict): filters of the search
+            cached (dict): filters of the cached search
+        """
+
+        # same department, and the same sort order
+        if filters["dep"] != cached["dep"]:
+            return False
+        if (bool(filters["agt"]), bool(filters["classifier"])) !=\
+                (bool(cached["agt"]), bool(cached["classifier"])):
+            return False
+
+        # every filter at least as narrow as the cached one
+        return all(not cached[name] or (filters[name] and cached[name] in filters[name])
+                   for name in FILTER_ROW_INDEX)
@@ -1,18 +1,62 @@
 """Module handling queries for the database."""
 
+import base64
+import binascii
 import json
+import re
 
 from contextlib import closing
 from sqlite3 import connect
 from datetime import datetime
 
-from lux_query_sql import QUERY_LUX
+from lux_db import join_indexes_exist, search_fts_is_fresh, search_table_is_fresh
+from lux_query_sql import (CANDIDATE_FILTERS, CANDIDATE_TABLES, DETAILS_AGENTS,
+                           DETAILS_AGENTS_BATCH, DETAILS_CLASSIFIERS, DETAILS_CLASSIFIERS_BATCH,
+                           DETAILS_JOIN, DETAILS_OBJECT, DETAILS_OBJECT_BATCH, DETAILS_PLACES,
+                           DETAILS_PLACES_BATCH, DETAILS_REFERENCES, DETAILS_REFERENCES_BATCH,
+                           QUERY_LUX_CANDIDATES, SEARCH_COLUMNS, SEARCH_FTS, SEARCH_QUERIES,
+                           SEARCH_TABLE)
+from request_timing import TimedCursor, phase
+import wire_format
+
+
+# "cte" always runs QUERY_LUX, "materialized" reads the search table built by lux_db.py
+# whenever it is up to date and falls back to QUERY_LUX otherwise, "fts" does the same but
+# also narrows the search rows down with the full-text index when it was built
+SEARCH_MODES = ("cte", "materialized", "fts")
+
+# "join" fetches the details of an object with one join over all of its relations,
+# "relations" runs one small query per relation and assembles the same response from those
+DETAILS_ENGINES = ("join", "relations")
+
+# number of rows per frame of a streamed search
+STREAM_BATCH_SIZE = 100
+
+# limit of a search that is not paged, and the largest page of a paged search
+MAX_SEARCH_ROWS = 1000
+
+# position of each column in the rows of SEARCH_QUERIES
+SEARCH_ROW_INDEX = {"id": 0, "label": 1, "artist": 2, "date": 3, "dep_name": 4,
+                    "classification": 5}
+
+# the trigram index can only look up a LIKE pattern with 3 consecutive non-wildcard characters
+FTS_INDEXABLE_TERM = re.compile(r"[^%_]{3}")
+
+# terms of the aggregated columns whose LIKE pattern may match across two agents (joined by ',')
+# or two classifiers (joined by ', '), so that no single agent or classifier matches it: the
+# wildcards match separators too, and only a term starting with the space of ', ' can span
+# the separator of two classifiers without containing its comma
+SPANNING_TERMS = {"agt": re.compile(r"[,%_]"), "classifier": re.compile(r"[,%_]|^ ")}
 
 
 class NoSearchResultsError(Exception):
     """Exception class to handle no search results."""
 
 
+class InvalidCursorError(Exception):
+    """Exception class to handle a page cursor that does not belong to the search."""
+
+
 class Query():
     """Abstract Query Class for querying databases.
     Query should be instantiated as LuxQuery or LuxDetailsQuery.
@@ -21,6 +65,16 @@ class Query():
     def __init__(self):
         raise NotImplementedError
 
+    def _connect(self):
+        """Returns a context manager for the connection used by a single search.
+        Borrows a connection from the pool given at init time if there is one,
+        otherwise opens a new one.
+        """
+
+        if self._pool is not None:
+            return self._pool.connection()
+        return connect(self._db_file, isolation_level=None, uri=True)
+
     def search(self):
         """Function that executes the query."""
 
@@ -48,19 +102,24 @@ class LuxQuery(Query):
     Stores the columns for the output table.
     """
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, pool=None, search_mode="cte"):
         """Initalizes the class with the database file and
         the columns and format_str for the output table.
         Args:
             db_file (str): database file
+            pool (ConnectionPool): pool to borrow connections from (optional)
+            search_mode (str): one of SEARCH_MODES
         """
 
         self._db_file = db_file
+        self._pool = pool
+        self._search_mode = search_mode
         self._columns = ["ID", "Label", "Date",
                          "Produced By", "Classified As"]
         self._format_str = ["w", "w", "w", "w", "w", "p"]
 
-    def search(self, dep=None, agt=None, classifier=None, label=None):
+    def search(self, dep=None, agt=None, classifier=None, label=None, page_size=None,
+               page_cursor=None, encoding=None, compression=None):
         """Opens a connection to the database and uses the given argument to create a
         SQL statement that query the database satisfying the search criteria.
 
@@ -69,85 +128,339 @@ class LuxQuery(Query):
             agt (str): selected agent
             classifer: selected slassifer
             label: selected label
+            page_size (int): number of rows per page, the search is not paged if None
+            page_cursor (str): next_cursor of the previous page, None for the first page
+            encoding (str): one of wire_format.ENCODINGS, "text" if None
+            compression (str): one of wire_format.COMPRESSIONS, or None
         Return:
            str: json containing the results of the query
 
         Arguments are by default None if not passed in.
         If no arguments are passed in output includes first 1000 objects in the database.
+        A paged search also returns next_cursor, which is None on the last page.
 
         Sort Order:
             Sorted first by object label/date, then by agent name/part,
             then by classifier, then by department name.
+            A paged search is finally sorted by object id.
         """
 
-        with connect(self._db_file, isolation_level=None, uri=True) as connection:
-            with closing(connection.cursor()) as cursor:
-                # making query backbone to be used in each of the 4 queries below
-                smt_str = QUERY_LUX
-                smt_count = 0
-                smt_params = []
-
-                # WHERE clause
-                if dep or label or agt or classifier:
-                    smt_str += " WHERE"
-                if dep:
-                    smt_str += " department.dep_name LIKE ?"
-                    smt_params.append(f"%{dep}%")
-                    smt_count += 1
-                if label:
-                    if smt_count >= 1:
-                        smt_str += " AND"
-                    smt_str += " objects.label LIKE ?"
-                    smt_params.append(f"%{label}%")
-                    smt_count += 1
-                if agt:
-                    if smt_count >= 1:
-                        smt_str += " AND"
-                    smt_str += " agent.artist LIKE ?"
-                    smt_count += 1
-                    smt_params.append(f"%{agt}%")
-                if classifier:
-                    if smt_count >= 1:
-                        smt_str += " AND"
-                    smt_str += " classifier.classification LIKE ?"
-                    smt_count += 1
-                    smt_params.append(f"%{classifier}%")
-
-                smt_str += " GROUP BY objects.id, objects.label"
-
-                # create the sort order for the query based on present args
-                sort_str = " ORDER BY objects.label, objects.date, "
-                sort_list = []
-                params_list = {
-                    agt: 'agent.artist',
-                    classifier:  'classifier.classification',
-                }
+        with self._connect() as connection:
+            with closing(connection.cursor(TimedCursor)) as cursor:
+                # execute the statement and fetch the results
+                smt_str, smt_params, sort_keys = self.search_statement(
+                    cursor, dep, agt, classifier, label, page_size, page_cursor)
+                cursor.execute(smt_str, smt_params)
+                data = cursor.fetchall()
 
-                for key, value in params_list.items():
-                    if key:
-                        sort_list.append(value)
+        with phase("process"):
+            if page_size is None:
+                return self.convert_to_json(len(data), data, encoding, compression)
 
-                for key, value in params_list.items():
-                    if not key:
-                        sort_list.append(value)
+            next_cursor = None
+            if len(data) > page_size:
+                data = data[:page_size]
+                next_cursor = self.encode_cursor(sort_keys, data[-1])
 
-                param_sort_str = sort_str + ", ".join(sort_list)
-                smt_str += param_sort_str
-                smt_str += " LIMIT 1000"
+            return self.convert_to_json(len(data), data, encoding, compression,
+                                        next_cursor=next_cursor)
 
-                # execute the statement and fetch the results
+    def search_stream(self, dep=None, agt=None, classifier=None, label=None, page_size=None,
+                      page_cursor=None, batch_size=STREAM_BATCH_SIZE, encoding=None,
+                      compression=None):
+        """Same search as search, but yields the results as newline-terminated json frames
+        while the rows are fetched instead of building one json string for all of them:
+            * a header frame with the columns and format_str
+            * rows frames with up to batch_size rows each
+            * a trailer frame with the search_count (and next_cursor if paged)
+
+        Args:
+            dep (str): selected department
+            agt (str): selected agent
+            classifer: selected slassifer
+            label: selected label
+            page_size (int): number of rows per page, the search is not paged if None
+            page_cursor (str): next_cursor of the previous page, None for the first page
+            batch_size (int): number of rows per rows frame
+            encoding (str): one of wire_format.ENCODINGS for the rows frames, "text" if None
+            compression (str): one of wire_format.COMPRESSIONS, or None
+        Return:
+            generator of str: json frames
+        """
+
+        with self._connect() as connection:
+            with closing(connection.cursor(TimedCursor)) as cursor:
+                smt_str, smt_params, sort_keys = self.search_statement(
+                    cursor, dep, agt, classifier, label, page_size, page_cursor)
                 cursor.execute(smt_str, smt_params)
-                data = cursor.fetchall()
-                search_count = len(data)
-        return self.convert_to_json(search_count, data)
 
-    def convert_to_json(self, data1, data2):
+                yield json.dumps({"frame": "header", "columns": self._columns,
+                                  "format_str": self._format_str}) + "\n"
+
+                # a paged search fetches one row more than the page to know if there is a next
+                row_limit = MAX_SEARCH_ROWS if page_size is None else page_size
+                search_count = 0
+                last_row = None
+                while search_count < row_limit and\
+                        (rows := cursor.fetchmany(min(batch_size, row_limit - search_count))):
+                    search_count += len(rows)
+                    last_row = rows[-1]
+                    with phase("process"):
+                        frame = wire_format.encode(
+                            {"frame": "rows", "data": [self.format_row(row) for row in rows]},
+                            encoding, compression) + "\n"
+                    yield frame
+
+                trailer = {"frame": "trailer", "search_count": search_count}
+                if page_size is not None:
+                    trailer["next_cursor"] = None
+                    if cursor.fetchone() is not None:
+                        trailer["next_cursor"] = self.encode_cursor(sort_keys, last_row)
+                yield json.dumps(trailer) + "\n"
+
+    def search_statement(self, cursor, dep, agt, classifier, label, page_size=None,
+                         page_cursor=None):
+        """Creates the SQL statement that query the database satisfying the search criteria.
+        A paged search continues after the row that page_cursor points to (keyset pagination),
+        so a page costs the same no matter how many pages come before it.
+
+        Args:
+            cursor: cursor the search runs on
+            dep (str): selected department
+            agt (str): selected agent
+            classifer: selected slassifer
+            label: selected label
+            page_size (int): number of rows per page, the search is not paged if None
+            page_cursor (str): next_cursor of the previous page, None for the first page
+        Return:
+            tuple: SQL statement, its parameters and the names of the sort columns
+        """
+
+        # making query backbone to be used in each of the 4 queries below
+        source = self._search_source(cursor)
+        columns = SEARCH_COLUMNS[source]
+        smt_str = SEARCH_QUERIES[source]
+        smt_count = 0
+        smt_params = []
+
+        # aggregate only the objects the filters can match, if it is cheaper than aggregating all
+        if source == "cte":
+            candidate_str, candidate_params = self._candidate_filter(dep, agt, classifier, label)
+            if candidate_str and join_indexes_exist(cursor, CANDIDATE_TABLES):
+                smt_str = QUERY_LUX_CANDIDATES.format(filter=candidate_str)
+                smt_params += candidate_params
+
+        # create the sort order for the query based on present args
+        # (pairs rather than a dict keyed by the terms, which would drop a column when both
+        # terms are equal, for instance both empty)
+        sort_keys = ["label", "date"]
+        params_list = [
+            (agt, 'artist'),
+            (classifier, 'classification'),
+        ]
+
+        for key, value in params_list:
+            if key:
+                sort_keys.append(value)
+
+        for key, value in params_list:
+            if not key:
+                sort_keys.append(value)
+
+        if page_size is not None:
+            sort_keys.append("id")
+
+        # WHERE clause
+        if dep or label or agt or classifier or page_cursor:
+            smt_str += " WHERE"
+        if dep:
+            smt_str += f" {columns['dep_name']} LIKE ?"
+            smt_params.append(f"%{dep}%")
+            smt_count += 1
+        if label:
+            if smt_count >= 1:
+                smt_str += " AND"
+            smt_str += f" {columns['label']} LIKE ?"
+            smt_params.append(f"%{label}%")
+            smt_count += 1
+        if agt:
+            if smt_count >= 1:
+                smt_str += " AND"
+            smt_str += f" {columns['artist']} LIKE ?"
+            smt_count += 1
+            smt_params.append(f"%{agt}%")
+        if classifier:
+            if smt_count >= 1:
+                smt_str += " AND"
+            smt_str += f" {columns['classification']} LIKE ?"
+            smt_count += 1
+            smt_params.append(f"%{classifier}%")
+        if source == "fts":
+            fts_str, fts_params = self._fts_filter(dep, agt, classifier, label)
+            if fts_str:
+                smt_str += " AND" + fts_str
+                smt_params += fts_params
+        if page_cursor:
+            if smt_count >= 1:
+                smt_str += " AND"
+            keyset_str, keyset_params = self._keyset_filter(
+                [columns[key] for key in sort_keys], self.decode_cursor(sort_keys, page_cursor))
+            smt_str += keyset_str
+            smt_params += keyset_params
+
+        smt_str += f" GROUP BY {columns['id']}, {columns['label']}"
+
+        smt_str += " ORDER BY " + ", ".join(columns[key] for key in sort_keys)
+        if page_size is None:
+            smt_str += f" LIMIT {MAX_SEARCH_ROWS}"
+        else:
+            smt_str += " LIMIT ?"
+            smt_params.append(page_size + 1)
+
+        return smt_str, smt_params, sort_keys
+
+    def encode_cursor(self, sort_keys, row):
+        """Creates the cursor that points to a row of a paged search.
+
+        Args:
+            sort_keys (list): names of the sort columns
+            row (tuple): row returned by the search query
+
+        Return:
+            str: opaque cursor
+        """
+
+        values = [row[SEARCH_ROW_INDEX[key]] for key in sort_keys]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, sort_keys, page_cursor):
+        """Reads the values of the sort columns back from a cursor made by encode_cursor.
+
+        Args:
+            sort_keys (list): names of the sort columns
+            page_cursor (str): cursor
+
+        Return:
+            list: value of each sort column
+        """
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(page_cursor.encode('ascii')))
+        except (ValueError, binascii.Error) as err:
+            raise InvalidCursorError from err
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            raise InvalidCursorError
+        return values
+
+    def _keyset_filter(self, sort_columns, values):
+        """Creates the condition for the rows that sort after the given values of the sort
+        columns. NULL sorts first, so it is compared with IS rather than = and >.
+
+        Args:
+            sort_columns (list): sort columns in ORDER BY order
+            values (list): value of each sort column
+
+        Return:
+            tuple: condition and its parameters
+        """
+
+        conditions = []
+        keyset_params = []
+        for index, (column, value) in enumerate(zip(sort_columns, values)):
+            parts = [f"{equal_column} IS ?" for equal_column in sort_columns[:index]]
+            keyset_params += values[:index]
+            if value is None:
+                parts.append(f"{column} IS NOT NULL")
+            else:
+                parts.append(f"{column} > ?")
+                keyset_params.append(value)
+            conditions.append("(" + " AND ".join(parts) + ")")
+
+        return " (" + " OR ".join(conditions) + ")", keyset_params
+
+    def _search_source(self, cursor):
+        """Picks the source of search rows for one search according to the search mode.
+
+        Args:
+            cursor: cursor the search runs on
+
+        Return:
+            str: key of SEARCH_QUERIES and SEARCH_COLUMNS
+        """
+
+        if self._search_mode == "fts" and search_fts_is_fresh(cursor):
+            return "fts"
+        if self._search_mode in ("materialized", "fts") and search_table_is_fresh(cursor):
+            return "materialized"
+        return "cte"
+
+    def _candidate_filter(self, dep, agt, classifier, label):
+        """Creates the condition on objects that QUERY_LUX_CANDIDATES aggregates the rows of.
+        Every object that matches the search satisfies it, and the LIKE conditions of the
+        search still decide which rows match, so the rows are the same as with QUERY_LUX.
+
+        The label and department filters are pushed down as they are. A filter on the artist
+        or the classification matches the agents or classifiers of an object concatenated, so
+        it is pushed down only if it cannot match across two of them (see SPANNING_TERMS).
+
+        Args:
+            dep (str): selected department
+            agt (str): selected agent
+            classifer: selected slassifer
+            label: selected label
+        Return:
+            tuple: condition (empty if no filter can be pushed down) and its parameters
+        """
+
+        candidate_terms = {"label": label, "dep": dep, "agt": agt, "classifier": classifier}
+        candidate_conditions = []
+        candidate_params = []
+        for name, term in candidate_terms.items():
+            if term and not (name in SPANNING_TERMS and SPANNING_TERMS[name].search(term)):
+                candidate_conditions.append(CANDIDATE_FILTERS[name])
+                candidate_params.append(f"%{term}%")
+
+        return " AND ".join(candidate_conditions), candidate_params
+
+    def _fts_filter(self, dep, agt, classifier, label):
+        """Creates the condition that looks the search rows up in the full-text index.
+        The index folds case more widely than LIKE does, so it only narrows the rows down
+        and the LIKE conditions of the search still decide which rows match.
+
+        Args:
+            dep (str): selected department
+            agt (str): selected agent
+            classifer: selected slassifer
+            label: selected label
+        Return:
+            tuple: condition (empty if no term can use the index) and its parameters
+        """
+
+        fts_terms = {"dep_name": dep, "label": label, "artist": agt, "classification": classifier}
+        fts_conditions = []
+        fts_params = []
+        for column, term in fts_terms.items():
+            if term and FTS_INDEXABLE_TERM.search(term):
+                fts_conditions.append(f"{column} LIKE ?")
+                fts_params.append(f"%{term}%")
+
+        if not fts_conditions:
+            return "", []
+
+        fts_str = f" {SEARCH_TABLE}.rowid IN (SELECT rowid FROM {SEARCH_FTS} WHERE "
+        fts_str += " AND ".join(fts_conditions) + ")"
+        return fts_str, fts_params
+
+    def convert_to_json(self, data1, data2, encoding=None, compression=None, **extra_fields):
         """Takes in the search_count and data and convert it to a json format
         while parsing the data to split agent and part and switching object date and object agent.
 
         Args:
             data1: search_count (int)
             data2: data (list)
+            encoding (str): one of wire_format.ENCODINGS, "text" if None
+            compression (str): one of wire_format.COMPRESSIONS, or None
+            extra_fields: additional fields of the response, such as next_cursor
 
         Return:
             str: json string
@@ -157,24 +470,36 @@ class LuxQuery(Query):
         data = data2
 
         for index, row in enumerate(data):
-            # drop department
-            row = row[:4] + row[5:]
-
-            # switch object date and object agent
-            object_date = row[3]
-            object_agent = row[2]
-            row = row[:2] + (object_date,) + (object_agent, ) + row[4:]
-
-            data[index] = row
+            data[index] = self.format_row(row)
 
         database_response = {
             "search_count": search_count,
             "columns": self._columns,
             "format_str": self._format_str,
-            "data": data
+            "data": data,
+            **extra_fields
         }
 
-        return json.dumps(database_response)
+        return wire_format.encode(database_response, encoding, compression)
+
+    def format_row(self, row):
+        """Drops the department of a row returned by the search query and switches
+        object date and object agent.
+
+        Args:
+            row (tuple): row returned by the search query
+
+        Return:
+            tuple: row in the order of the columns of the output table
+        """
+
+        # drop department
+        row = row[:4] + row[5:]
+
+        # switch object date and object agent
+        object_date = row[3]
+        object_agent = row[2]
+        return row[:2] + (object_date,) + (object_agent, ) + row[4:]
 
     def format_data(self, data):
         pass
@@ -189,8 +514,10 @@ class LuxDetailsQuery(Query):
     Stores the columns for the output table.
     """
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, pool=None, engine="join"):
         self._db_file = db_file
+        self._pool = pool
+        self._engine = engine
         self._columns_produced_by = [
             "Part", "Name", "Timespan", "Nationalities"]
         self._columns_information = ["Type", "Content"]
@@ -208,36 +535,16 @@ class LuxDetailsQuery(Query):
             str: json formatted data of the object
         """
 
-        with connect(self._db_file, isolation_level=None, uri=True) as connection:
-            with closing(connection.cursor()) as cursor:
-                # objects.label, productions.part, agents.name, nationalities.descriptor,
-                # agents.begin_date, agents.end_date, classifiers.name
-                smt_str = "SELECT DISTINCT objects.label, productions.part, agents.name,"
-                smt_str += "agents.begin_date, agents.end_date,"
-                smt_str += " nationalities.descriptor, classifiers.name,"
-                smt_str += " \"references\".type, \"references\".content, agents.id,"
-                # fetch additional data
-                smt_str += " objects.accession_no, objects.date, places.label"
-                # joining objects and agents using productions
-                smt_str += " FROM objects LEFT OUTER JOIN"
-                smt_str += " productions ON productions.obj_id = objects.id"
-                smt_str += " LEFT OUTER JOIN agents on productions.agt_id = agents.id"
-                # joining nationalities using agents_nationalities
-                smt_str += " LEFT OUTER JOIN agents_nationalities"
-                smt_str += " ON agents_nationalities.agt_id = agents.id"
-                smt_str += " LEFT OUTER JOIN nationalities ON"
-                smt_str += " nationalities.id = agents_nationalities.nat_id"
-                # joining references
-                smt_str += " LEFT OUTER JOIN \"references\" ON \"references\".obj_id = objects.id"
-                # joining classifiers using objects_classifiers
-                smt_str += " LEFT OUTER JOIN objects_classifiers ON"
-                smt_str += " objects_classifiers.obj_id = objects.id"
-                smt_str += " LEFT OUTER JOIN classifiers"
-                smt_str += " ON classifiers.id = objects_classifiers.cls_id"
-                # joining places using objects_places
-                smt_str += " LEFT OUTER JOIN objects_places ON objects_places.obj_id = objects.id"
-                smt_str += " LEFT OUTER JOIN places ON objects_places.pl_id = places.id"
-                smt_str += " WHERE objects.id = ?"
+        if self._engine == "relations":
+            with self._connect() as connection:
+                with closing(connection.cursor(TimedCursor)) as cursor:
+                    relations = self.fetch_relations(cursor, obj_id)
+            with phase("process"):
+                return self.build_response(*self.assemble_relations(relations))
+
+        with self._connect() as connection:
+            with closing(connection.cursor(TimedCursor)) as cursor:
+                smt_str = DETAILS_JOIN
                 smt_params = [obj_id]
 
                 # execute the statement and fetch the results
@@ -246,8 +553,53 @@ class LuxDetailsQuery(Query):
                 if not data:
                     raise NoSearchResultsError
 
-        # data cleaning
-        agent_dict, obj_dict = self.clean_data(data)
+        with phase("process"):
+            # data cleaning
+            agent_dict, obj_dict = self.clean_data(data)
+
+            return self.build_response(agent_dict, obj_dict)
+
+    def search_batch(self, obj_ids):
+        """Looks up the details of several objects at once. With the relations engine each
+        relation of all the objects is fetched by one query over the list of ids; the join
+        engine runs search for one object after the other.
+
+        Args:
+            obj_ids (list): objects' ids
+
+        Return:
+            dict: json formatted data of each object that exists, by str of its id
+        """
+
+        responses = {}
+        if self._engine != "relations":
+            for obj_id in obj_ids:
+                try:
+                    responses[str(obj_id)] = self.search(obj_id)
+                except NoSearchResultsError:
+                    pass
+            return responses
+
+        with self._connect() as connection:
+            with closing(connection.cursor(TimedCursor)) as cursor:
+                batch_relations = self.fetch_relations_batch(cursor, obj_ids)
+
+        with phase("process"):
+            for obj_id, relations in batch_relations.items():
+                responses[str(obj_id)] = self.build_response(*self.assemble_relations(relations))
+        return responses
+
+    def build_response(self, agent_dict, obj_dict):
+        """Sorts and formats the object and agent dictionaries made by clean_data
+        (or assemble_relations) and converts them to json.
+
+        Args:
+            agent_dict (dict): dictionary of all the agents
+            obj_dict (dict): dictionary containing object data
+
+        Return:
+            str: json formatted data of the object
+        """
 
         # sort ordering
         obj_dict['classifier'].sort()
@@ -271,6 +623,127 @@ class LuxDetailsQuery(Query):
         agent_rows_list = self.format_data(agent_dict)
         return self.convert_to_json(agent_rows_list, obj_dict)
 
+    def fetch_relations(self, cursor, obj_id):
+        """Fetches the object and each of its relations with one query per relation,
+        in the order the rows of the join in search come in.
+
+        Args:
+            cursor: cursor of an open connection
+            obj_id (str): object's id
+
+        Return:
+            dict: the object row and the distinct rows of each relation, with a row of
+            None values for a relation the object has no rows in
+        """
+
+        cursor.execute(DETAILS_OBJECT, [obj_id])
+        obj_row = cursor.fetchone()
+        if obj_row is None:
+            raise NoSearchResultsError
+
+        relations = {"object": obj_row}
+        for relation, smt_str, width in [("agents", DETAILS_AGENTS, 6),
+                                         ("references", DETAILS_REFERENCES, 2),
+                                         ("classifiers", DETAILS_CLASSIFIERS, 1),
+                                         ("places", DETAILS_PLACES, 1)]:
+            cursor.execute(smt_str, [obj_id])
+            # SELECT DISTINCT keeps the first of equal rows, so does dict.fromkeys
+            relations[relation] = list(dict.fromkeys(cursor.fetchall())) or [(None,) * width]
+
+        return relations
+
+    def fetch_relations_batch(self, cursor, obj_ids):
+        """Fetches the objects and their relations like fetch_relations does for one object,
+        with one query per relation for all of the objects.
+
+        Args:
+            cursor: cursor of an open connection
+            obj_ids (list): objects' ids
+
+        Return:
+            dict: the relations of each object that exists, by its id
+        """
+
+        ids = ", ".join("?" * len(obj_ids))
+        cursor.execute(DETAILS_OBJECT_BATCH.format(ids=ids), obj_ids)
+        batch_relations = {row[0]: {"object": row[1:]} for row in cursor.fetchall()}
+
+        for relation, smt_str, width in [("agents", DETAILS_AGENTS_BATCH, 6),
+                                         ("references", DETAILS_REFERENCES_BATCH, 2),
+                                         ("classifiers", DETAILS_CLASSIFIERS_BATCH, 1),
+                                         ("places", DETAILS_PLACES_BATCH, 1)]:
+            cursor.execute(smt_str.format(ids=ids), obj_ids)
+            rows = {obj_id: {} for obj_id in batch_relations}
+            for row in cursor.fetchall():
+                if row[0] in rows:
+                    # dict keeps the first of equal rows, like SELECT DISTINCT does
+                    rows[row[0]].setdefault(row[1:], None)
+            for obj_id, relations in batch_relations.items():
+                relations[relation] = list(rows[obj_id]) or [(None,) * width]
+
+        return batch_relations
+
+    def assemble_relations(self, relations):
+        """Creates the same agent and object dictionaries as clean_data, without expanding the
+        rows of the relations into the product that the join in search returns.
+
+        In that product every reference appears once for each combination of an agent row,
+        a classifier and a place. clean_data keeps the type of the first reference with
+        a given content, and keeps one more type for every repeated row of a reference
+        whose type is empty, which is reproduced here by counting.
+
+        Args:
+            relations (dict): rows returned by fetch_relations
+
+        Return:
+            agent_dict (dict): same as in clean_data
+            obj_dict (dict): same as in clean_data
+        """
+
+        label, obj_accession_no, obj_date = relations["object"]
+
+        agent_dict = {}
+        for part_produced, produced_by, begin_date, end_date, nationality, agent_id in\
+                relations["agents"]:
+            timespan = self.parse_date(begin_date, end_date)
+            if agent_id not in agent_dict:
+                agent_dict[agent_id] = {
+                    "part": part_produced,
+                    "name": produced_by,
+                    "timespan": timespan,
+                    "nationality": [nationality],
+                }
+            elif nationality not in agent_dict[agent_id]['nationality']:
+                agent_dict[agent_id]['nationality'].append(nationality)
+
+        repeats = len(relations["agents"]) * len(relations["classifiers"])
+        repeats *= len(relations["places"])
+
+        ref_types = []
+        ref_contents = []
+        seen_contents = set()
+        for ref_type, ref_content in relations["references"]:
+            occurrences = repeats
+            if ref_content not in seen_contents:
+                seen_contents.add(ref_content)
+                ref_types.append(ref_type)
+                ref_contents.append(ref_content)
+                occurrences -= 1
+            if not ref_type:
+                ref_types.extend([ref_type] * occurrences)
+
+        obj_dict = {
+            "label": label,
+            "classifier": [row[0] for row in relations["classifiers"]],
+            "ref_type": ref_types,
+            "ref_content": ref_contents,
+            "accession_no": obj_accession_no,
+            "date": obj_date,
+            "place": relations["places"][0][0],
+        }
+
+        return agent_dict, obj_dict
+
     def sort_by_order_ref(self, x_data, y_data):
         """Function that sort the references by type and content
 
@@ -442,3 +915,31 @@ class LuxDetailsQuery(Query):
             end_year = end_date_dt.year
 
         return f"{begin_year}-{end_year}"
+
+
+def compare_details_engines(db_file, batch_size=500):
+    """Looks up the details of every object of a database with each of DETAILS_ENGINES, which
+    must return the same response byte for byte, with or without the indexes of lux_db.py.
+
+    Args:
+        db_file (str): database file
+        batch_size (int): number of objects looked up at once by the relations engine
+
+    Return:
+        tuple: number of objects compared, list of the ids of those whose details differ
+    """
+
+    with closing(connect(db_file)) as connection:
+        obj_ids = [row[0] for row in connection.execute("SELECT id FROM objects ORDER BY id")]
+
+    join_query = LuxDetailsQuery(db_file, engine="join")
+    relations_query = LuxDetailsQuery(db_file, engine="relations")
+    differing = []
+    for start in range(0, len(obj_ids), batch_size):
+        batch = obj_ids[start:start + batch_size]
+        joined = join_query.search_batch(batch)
+        related = relations_query.search_batch(batch)
+        differing.extend(obj_id for obj_id in batch
+                         if joined.get(str(obj_id)) != related.get(str(obj_id)))
+
+    return len(obj_ids), differing
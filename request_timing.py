@@ -0,0 +1,310 @@
+"""Module for timing the phases of the requests to the server: latency histograms for the
+stats request and a log of slow requests with the query plans of their statements.
+
+The server creates a RequestTimer for each request and makes it the active timer of the thread
+(or asyncio task) that works on the request; the query code records its phases in the active
+timer, if there is one, through phase and TimedCursor.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from contextlib import closing, contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+
+from connection_pool import connect_readonly
+from lux_db import explain_query
+
+# parse: decoding the request, execute: running SQL statements up to their first row,
+# fetch: reading the rest of their rows, process: building the response from the rows
+# (convert_to_json, clean_data and friends), write: writing the response to the socket
+PHASES = ("parse", "execute", "fetch", "process", "write")
+
+# upper bounds of the buckets of the latency histograms; the last bucket counts the rest
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# statements of a request kept for the slow query log
+MAX_LOGGED_STATEMENTS = 20
+
+_active_timer = ContextVar("active_timer", default=None)
+
+
+class RequestTimer():
+    """Class that adds up the time a request spends in each of PHASES. Phases can nest, in
+    which case the time of the inner phase is not counted in the outer one.
+    A RequestTimer is used by one thread at a time.
+    """
+
+    def __init__(self):
+        """Starts the clock of the request."""
+
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.ran = set()
+        self.statements = []
+        self._started = time.perf_counter()
+        self._stack = []
+        self._since = self._started
+
+    @contextmanager
+    def phase(self, phase_name):
+        """Context manager that counts the time spent in its body in phase_name.
+
+        Args:
+            phase_name (str): one of PHASES
+        """
+
+        self._switch()
+        self._stack.append(phase_name)
+        self.ran.add(phase_name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._stack.pop()
+
+    def _switch(self):
+        """Counts the time since the last switch in the current phase, if any."""
+
+        now = time.perf_counter()
+        if self._stack:
+            self.phases[self._stack[-1]] += now - self._since
+        self._since = now
+
+    @contextmanager
+    def active(self):
+        """Context manager that makes this timer the active timer in its body."""
+
+        token = _active_timer.set(self)
+        try:
+            yield self
+        finally:
+            _active_timer.reset(token)
+
+    def run(self, function, *args):
+        """Calls function with this timer active, for instance on an executor thread.
+
+        Args:
+            function (callable): function to call
+            args: its arguments
+
+        Return:
+            what function returns
+        """
+
+        with self.active():
+            return function(*args)
+
+    def add_statement(self, smt_str, smt_params):
+        """Keeps a statement that the request executed, for the slow query log.
+
+        Args:
+            smt_str (str): SQL statement
+            smt_params: its parameters
+        """
+
+        if len(self.statements) < MAX_LOGGED_STATEMENTS:
+            self.statements.append((smt_str, list(smt_params)))
+
+    def merge(self, other):
+        """Adds the phases and statements of a timer of the same request, such as one that
+        timed it in a worker process.
+
+        Args:
+            other (RequestTimer): timer to add
+        """
+
+        for phase_name, seconds in other.phases.items():
+            self.phases[phase_name] += seconds
+        self.ran |= other.ran
+        for smt_str, smt_params in other.statements:
+            self.add_statement(smt_str, smt_params)
+
+    def total(self):
+        """Returns the seconds since the request started."""
+
+        return time.perf_counter() - self._started
+
+    def summary(self, total=None):
+        """Returns the total and the time of each phase in milliseconds, as text for the log.
+
+        Args:
+            total (float): seconds the request took, total() if None
+        """
+
+        total = self.total() if total is None else total
+        phases = ", ".join(f"{phase_name} {seconds * 1000:.1f}"
+                           for phase_name, seconds in self.phases.items())
+        return f"{total * 1000:.1f} ms ({phases})"
+
+
+def phase(phase_name):
+    """Returns a context manager that counts the time spent in its body in phase_name of the
+    active timer, or that does nothing if no timer is active.
+
+    Args:
+        phase_name (str): one of PHASES
+    """
+
+    timer = _active_timer.get()
+    if timer is None:
+        return nullcontext()
+    return timer.phase(phase_name)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that counts the time spent executing statements and fetching their rows in the
+    active timer, and keeps the statements it executes there. Create it with
+    connection.cursor(TimedCursor).
+    """
+
+    def execute(self, sql, parameters=(), /):
+        """Executes a statement (sqlite3.Cursor override)."""
+
+        timer = _active_timer.get()
+        if timer is None:
+            return super().execute(sql, parameters)
+        timer.add_statement(sql, parameters)
+        with timer.phase("execute"):
+            return super().execute(sql, parameters)
+
+    def fetchone(self):
+        """Fetches the next row (sqlite3.Cursor override)."""
+
+        with phase("fetch"):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        """Fetches the next rows (sqlite3.Cursor override)."""
+
+        with phase("fetch"):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        """Fetches the remaining rows (sqlite3.Cursor override)."""
+
+        with phase("fetch"):
+            return super().fetchall()
+
+
+class LatencyHistograms():
+    """Class for thread-safe histograms of the latency of requests and of each of their phases,
+    kept per kind of request.
+    """
+
+    def __init__(self):
+        """Initializes empty histograms."""
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, kind, timer, total):
+        """Counts a finished request.
+
+        Args:
+            kind (str): kind of the request
+            timer (RequestTimer): timer of the request
+            total (float): seconds the request took
+        """
+
+        with self._lock:
+            histograms = self._histograms.setdefault(
+                kind, {name: [0] * (len(LATENCY_BUCKETS_MS) + 1) for name in ("total", *PHASES)})
+            histograms["total"][self._bucket(total)] += 1
+            # a phase the request never went through (no execute for a cache hit, for
+            # instance) is not counted, rather than counted as instantaneous
+            for phase_name in timer.ran:
+                histograms[phase_name][self._bucket(timer.phases[phase_name])] += 1
+
+    def _bucket(self, seconds):
+        """Returns the index of the bucket that a latency falls in."""
+
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                return index
+        return len(LATENCY_BUCKETS_MS)
+
+    def stats(self):
+        """Returns the histograms: for each kind of request, the number of requests and, for the
+        total and each phase, the count of each bucket of buckets_ms. The last count is that of
+        the latencies above the last bound. The histogram of a phase only counts the requests
+        that went through it, so its counts add up to their number.
+
+        Return:
+            dict: histograms that can be dumped to json
+        """
+
+        with self._lock:
+            return {"buckets_ms": list(LATENCY_BUCKETS_MS),
+                    "requests": {kind: {"count": sum(histograms["total"]),
+                                        **{name: list(counts)
+                                           for name, counts in histograms.items()}}
+                                 for kind, histograms in self._histograms.items()}}
+
+
+class SlowQueryLog():
+    """Class for a log of the requests that take longer than a threshold, one json object per
+    line with the request, the time of each phase and the statements the request executed along
+    with their query plans.
+    """
+
+    def __init__(self, db_file, log_file, threshold):
+        """Opens the log for appending.
+
+        Args:
+            db_file (str): database file, to explain the statements on
+            log_file (str): file to append the slow requests to
+            threshold (float): seconds a request must exceed to be logged
+        """
+
+        self._db_file = db_file
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._connection = None
+        self._log_file = open(log_file, 'a', encoding='utf-8')
+
+    def log(self, kind, request, timer, total):
+        """Appends a request to the log if it was slow.
+
+        Args:
+            kind (str): kind of the request
+            request (dict): request read from the client
+            timer (RequestTimer): timer of the request
+            total (float): seconds the request took
+
+        Return:
+            bool: True if the request was logged
+        """
+
+        if total <= self._threshold:
+            return False
+
+        with self._lock:
+            entry = {
+                "time": datetime.now().isoformat(timespec='milliseconds'),
+                "kind": kind,
+                "request": request,
+                "total_ms": round(total * 1000, 3),
+                "phases_ms": {phase_name: round(seconds * 1000, 3)
+                              for phase_name, seconds in timer.phases.items()},
+                "statements": [{"sql": smt_str, "params": smt_params,
+                                "plan": self._explain(smt_str, smt_params)}
+                               for smt_str, smt_params in timer.statements],
+            }
+            self._log_file.write(json.dumps(entry, default=str) + "\n")
+            self._log_file.flush()
+        return True
+
+    def _explain(self, smt_str, smt_params):
+        """Returns the query plan of a statement, or the error that explaining it raised."""
+
+        try:
+            if self._connection is None:
+                self._connection = connect_readonly(self._db_file)
+            with closing(self._connection.cursor()) as cursor:
+                return explain_query(cursor, smt_str, smt_params)
+        except sqlite3.Error as err:
+            return [f"error: {err}"]
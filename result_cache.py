@@ -0,0 +1,109 @@
+"""Module for an in-process cache of serialized query results."""
+
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class ResultCache():
+    """Class for a thread-safe LRU cache of responses with an optional time to live.
+    The cache can be bounded by its number of entries, by the memory its responses take up,
+    or both. Every entry is dropped as soon as the modification time of the database file
+    changes, so a cached response is never older than the data it was computed from.
+    """
+
+    def __init__(self, db_file, max_entries=None, ttl=None, max_bytes=None):
+        """Initalizes an empty cache.
+
+        Args:
+            db_file (str): database file whose changes invalidate the cache
+            max_entries (int): number of responses kept before the least recently used is evicted
+            ttl (float): seconds a response stays valid, forever if None
+            max_bytes (int): bytes of responses kept before the least recently used is evicted
+        """
+
+        self._db_file = db_file
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db_mtime = self._read_db_mtime()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached response for key, or None if there is no valid one.
+
+        Args:
+            key: hashable key of the request
+        """
+
+        db_mtime = self._read_db_mtime()
+        with self._lock:
+            if db_mtime != self._db_mtime:
+                self._entries.clear()
+                self._bytes = 0
+                self._db_mtime = db_mtime
+
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None and entry[1] < time.monotonic():
+                self._evict(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        """Stores the response for key, evicting the least recently used responses if needed.
+
+        Args:
+            key: hashable key of the request
+            response (str): response to cache
+        """
+
+        size = sys.getsizeof(response)
+        if (self._max_entries is not None and self._max_entries <= 0) or\
+                (self._max_bytes is not None and size > self._max_bytes):
+            return
+
+        expires = None if self._ttl is None else time.monotonic() + self._ttl
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (response, expires, size)
+            self._bytes += size
+            while (self._max_entries is not None and len(self._entries) > self._max_entries) or\
+                    (self._max_bytes is not None and self._bytes > self._max_bytes):
+                self._evict(next(iter(self._entries)))
+
+    def stats(self):
+        """Returns a dictionary with the hit and miss counters, the number of entries
+        and the bytes they take up.
+        """
+
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "bytes": self._bytes}
+
+    def _evict(self, key):
+        """Removes the entry for key. The caller must hold the lock."""
+
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _read_db_mtime(self):
+        """Returns the modification time of the database file, or None if it cannot be read."""
+
+        try:
+            return os.stat(self._db_file).st_mtime_ns
+        except OSError:
+            return None
@@ -0,0 +1,143 @@
+"""Module for the list model that holds the search results shown by the GUI."""
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from table import Table
+
+# every column of the search results is wrapped, at the width of its widest value
+SEARCH_FORMAT_STR = ['w', 'w', 'w', 'w', 'w']
+
+
+class _ColumnarRows():
+    """Read-only view of a SearchResultsModel's columns as a list of rows,
+    so a Table can format the rows without copying them.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def __getitem__(self, row_idx):
+        return [column[row_idx] for column in self._columns]
+
+
+class SearchResultsModel(QAbstractListModel):
+    """Class that holds the rows of a search, one list per column, for a QListView.
+    A row is formatted with Table.lines_for_row only when the view asks for it,
+    so only the rows on screen are ever formatted.
+    """
+
+    def __init__(self, parent=None):
+        """Initializes an empty model.
+
+        Args:
+            parent: parent QObject
+        """
+
+        super().__init__(parent)
+        self._column_names = []
+        self._columns = []
+        self._column_widths = []
+        self._table = None
+
+    def clear(self):
+        """Drops the rows of the previous search."""
+
+        self.beginResetModel()
+        self._column_names = []
+        self._columns = []
+        self._column_widths = []
+        self._table = None
+        self.endResetModel()
+
+    def reset(self, column_names):
+        """Drops the rows of the previous search and starts a new one.
+
+        Args:
+            column_names (list): names of the columns of the new search
+        """
+
+        self.beginResetModel()
+        self._column_names = list(column_names)
+        self._columns = [[] for _ in self._column_names]
+        self._column_widths = [len(str(column_name)) for column_name in self._column_names]
+
+        # the table reads the rows through the view, so it sees the rows appended later on
+        self._table = Table(self._column_names, _ColumnarRows(self._columns),
+                            max_width=float('inf'), format_str=SEARCH_FORMAT_STR)
+        self._table.column_widths = self._column_widths
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        """Adds rows after the ones in the model. If a new row is wider than a column,
+        the column is widened and the rows already shown are redrawn.
+
+        Args:
+            rows (list): rows of the search response
+        """
+
+        if not rows:
+            return
+
+        first_row = self.rowCount()
+        widened = False
+
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(rows) - 1)
+        for index, column in enumerate(self._columns):
+            column.extend(row[index] for row in rows)
+            width = max(len(str(row[index])) for row in rows)
+            if width > self._column_widths[index]:
+                self._column_widths[index] = width
+                widened = True
+        self.endInsertRows()
+
+        if widened and first_row:
+            self.dataChanged.emit(self.index(0), self.index(first_row - 1))
+
+    def object_id(self, row_idx):
+        """Returns the object id of a row.
+
+        Args:
+            row_idx (int): index of the row
+
+        Return:
+            id of the object in the row
+        """
+
+        return self._columns[0][row_idx]
+
+    def rowCount(self, parent=QModelIndex()):
+        """Returns the number of rows in the model (Qt override).
+
+        Args:
+            parent (QModelIndex): parent index, always invalid for a list
+
+        Return:
+            int: number of rows
+        """
+
+        if parent.isValid() or not self._columns:
+            return 0
+        return len(self._columns[0])
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Returns the formatted row for the display role and the object id
+        for the user role (Qt override).
+
+        Args:
+            index (QModelIndex): index of the row
+            role (int): role of the data
+
+        Return:
+            str or id of the object, None for any other role
+        """
+
+        if not index.isValid() or index.row() >= self.rowCount():
+            return None
+        if role == Qt.DisplayRole:
+            return ''.join(self._table.lines_for_row(index.row()))
+        if role == Qt.UserRole:
+            return self.object_id(index.row())
+        return None
@@ -0,0 +1,168 @@
+"""Module for the keep-alive connections of the GUI to the server."""
+
+import itertools
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+from socket import socket, IPPROTO_TCP, TCP_NODELAY
+
+# seconds a connection stays in the pool; below the server's default idle timeout,
+# so pooled connections are rarely closed by the server before they are reused
+DEFAULT_MAX_IDLE = 50
+
+
+class SessionConnection():
+    """Class for one connection in session mode: the server answers every request on it
+    after a line with the request_id of the request, and keeps it open for the next one.
+    """
+
+    def __init__(self, address, request_ids):
+        """Connects to the server.
+
+        Args:
+            address (tuple): host and port of the server
+            request_ids (iterator): source of the request ids
+        """
+
+        self._address = address
+        self._request_ids = request_ids
+        self._sock = None
+        self._in_flo = None
+        self._out_flo = None
+        self.reused = False
+        self.finished = True
+        self.last_used = time.monotonic()
+        self._open()
+
+    def _open(self):
+        """Opens the socket of the connection."""
+
+        self._sock = socket()
+        # requests are small and each one is flushed: send them without delay
+        self._sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self._sock.connect(self._address)
+        self._in_flo = self._sock.makefile(mode='r', encoding='utf-8')
+        self._out_flo = self._sock.makefile(mode='w', encoding='utf-8')
+
+    def close(self):
+        """Closes the socket of the connection."""
+
+        for closeable in (self._in_flo, self._out_flo, self._sock):
+            try:
+                closeable.close()
+            except OSError:
+                pass
+
+    def send(self, request):
+        """Sends a request and reads the line that starts its response. A reused connection
+        that the server has closed in the meantime is replaced by a new one; the requests
+        only read the database, so sending one again is safe.
+
+        Args:
+            request (dict): request for the server
+        """
+
+        request_id = next(self._request_ids)
+        data = json.dumps(dict(request, session=True, request_id=request_id)) + "\n"
+        self.finished = False
+
+        try:
+            envelope = self._exchange(data)
+        except OSError:
+            if not self.reused:
+                raise
+            self.close()
+            self._open()
+            self.reused = False
+            envelope = self._exchange(data)
+
+        if json.loads(envelope).get("request_id") != request_id:
+            raise ConnectionError("The server answered another request")
+
+    def _exchange(self, data):
+        """Writes a request and returns the line that starts its response.
+
+        Args:
+            data (str): request as a json line
+
+        Return:
+            str: json line with the request_id
+        """
+
+        self._out_flo.write(data)
+        self._out_flo.flush()
+        envelope = self._in_flo.readline()
+        if envelope == '':
+            raise ConnectionResetError("The server has crashed")
+        return envelope
+
+    def readline(self):
+        """Returns the next line of the response, '' if the server closed the connection."""
+
+        return self._in_flo.readline()
+
+    def finish(self):
+        """Marks the response as read entirely, so the connection can take the next request."""
+
+        self.finished = True
+
+
+class ServerSession():
+    """Class for a thread-safe pool of keep-alive connections to the server.
+    A connection is only reused once its last response has been read entirely, so a
+    request abandoned halfway (for instance a superseded search) closes its connection.
+    """
+
+    def __init__(self, server_host, server_port, max_idle=DEFAULT_MAX_IDLE):
+        """Initializes an empty pool.
+
+        Args:
+            server_host (str): host of the server
+            server_port (int): port of the server
+            max_idle (float): seconds an unused connection is kept
+        """
+
+        self._address = (server_host, server_port)
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that lends a connection, opening one if none is idle.
+
+        Yields:
+            SessionConnection: connection to send a request on
+        """
+
+        conn = None
+        with self._lock:
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                if time.monotonic() - conn.last_used > self._max_idle:
+                    conn.close()
+                    conn = None
+        if conn is None:
+            conn = SessionConnection(self._address, self._request_ids)
+
+        try:
+            yield conn
+        finally:
+            if conn.finished:
+                conn.reused = True
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """Closes the idle connections."""
+
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
@@ -0,0 +1,64 @@
+"""Module for running the requests of the GUI to the server off the Qt UI thread."""
+
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+
+class ServerWorkerSignals(QObject):
+    """Signals of a ServerWorker. They are created on the UI thread, so the connected
+    callbacks run on the UI thread even though the worker emits them from a pool thread.
+
+    Every signal carries the request id of its worker, so the GUI can drop the results
+    of requests it no longer waits for.
+    """
+
+    result = Signal(int, object)
+    error = Signal(int, object)
+    finished = Signal(int)
+
+
+class ServerWorker(QRunnable):
+    """Class that runs one request to the server on a QThreadPool thread and emits
+    each result (a frame of a streamed response, or the whole response) as it arrives.
+    """
+
+    def __init__(self, request_id, fetch):
+        """Initializes the worker.
+
+        Args:
+            request_id (int): id sent along with every signal of this worker
+            fetch (callable): function without arguments that talks to the server and returns
+                an iterable of results; an exception it raises is emitted by the error signal
+        """
+
+        super().__init__()
+        self.request_id = request_id
+        self.signals = ServerWorkerSignals()
+        self._fetch = fetch
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stops the worker before its next result; results already emitted are not undone."""
+
+        self._cancelled.set()
+
+    def run(self):
+        """Talks to the server and emits the results (QRunnable override)."""
+
+        try:
+            results = iter(self._fetch())
+            try:
+                for result in results:
+                    if self._cancelled.is_set():
+                        break
+                    self.signals.result.emit(self.request_id, result)
+            finally:
+                # closing a streamed response closes its socket
+                if hasattr(results, 'close'):
+                    results.close()
+        except Exception as err:
+            if not self._cancelled.is_set():
+                self.signals.error.emit(self.request_id, err)
+        finally:
+            self.signals.finished.emit(self.request_id)
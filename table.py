@@ -10,12 +10,28 @@ The table generated by this program has the following properties:
         * Format specifiers are in the FormatSpec class; the format_str argument to Table.__init__ should be a string of those letters (currently 'p', 'w', or 't').
 
 A Table can be displayed either by calling __str__ or by iterating through each row of the table and printing it.
+
+A StreamingTable formats rows as they are read from an iterable, for tables too large to keep in memory.
 """
 
 import textwrap
 import itertools
+from collections.abc import Iterable, Iterator
 from enum import Enum
+from functools import lru_cache
+from heapq import heapify, heappop, heappush
 import shutil
+import threading
+
+# Number of (value, width) pairs whose wrapped lines are remembered across all tables.
+WRAP_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def _wrap(text: str, width: int) -> tuple[str, ...]:
+    """Returns textwrap.wrap(text, width) as a tuple, memoized since the same values are wrapped at the same widths every time a row is displayed."""
+
+    return tuple(textwrap.wrap(text, width))
 
 
 class FormatSpec(Enum):
@@ -44,6 +60,7 @@ class Table:
                 # A row is an iterable of strings, with one element per line
                 for line in row:
                     print(line)
+          Each iteration is independent of the others, so a Table can be iterated through by several loops (or threads) at once.
         * stringifiable. To get a string containing all rows in the table including headers, use str(a_table).
 
     The statment a_table.headers() is the same as a_table[-1], and they both return an iterable of strings.
@@ -114,6 +131,7 @@ class Table:
         self._preformat_sep = preformat_sep or Table._PREFORMAT_SEPARATOR
         self._dots = dots or Table._DOTS
         self._column_widths = []
+        self._lock = threading.Lock()
 
     @property
     def column_widths(self, *, recompute=False) -> list[int]:
@@ -130,34 +148,26 @@ class Table:
         """
 
         if recompute or not self._column_widths:
-            # Preliminary computation of the width of each column as the length of the longer of:
-            #   - the longest value in that column
-            #   - the length of the column name
-
-            columns = tuple(zip(self._column_names, *self._data))
-            for fmt, column in zip(self._format_spec, columns):
-                # A PREFORMATTED column needs special treatment. A PREFORMATTED column actually contains several lines before any wrapping functions are applied; we want the longest of those lines.
-                if fmt == FormatSpec.PREFORMATTED:
-                    col_lines = []
-                    for row in column:
-                        col_lines += (str(x)
-                                      for x in row.split(self._preformat_sep))
-                    width = max(len(line) for line in col_lines)
-                else:
-                    width = max((len(str(line)) for line in column))
-                self._column_widths.append(width)
-
-            # Redistribute the columns so they fit in self._max_width
-            self._column_widths = self._redistribute_widths()
+            # The widths are computed once even if several threads ask for them at the same time, and published only when complete
+            with self._lock:
+                if recompute or not self._column_widths:
+                    # Preliminary computation of the width of each column as the length of the longer of:
+                    #   - the longest value in that column
+                    #   - the length of the column name
+                    nominal_widths = self._nominal_widths()
+
+                    # Redistribute the columns so they fit in self._max_width
+                    self._column_widths = self._redistribute_widths(nominal_widths)
 
         return self._column_widths
 
     @column_widths.setter
-    def set_column_widths(self, col_widths: list[int]):
+    def column_widths(self, col_widths: list[int]):
         """Setter for column_widths property, providing the capability to manually set the widths of columns in a Table.
         """
 
-        self._column_widths = col_widths
+        with self._lock:
+            self._column_widths = col_widths
 
     def lines_for_row(self, row_idx: int) -> list[str]:
         """Generates the lines of text needed to print row row_idx with appropriate formatting, and returns those lines as a list of strings.
@@ -171,36 +181,72 @@ class Table:
             return idx < 0
 
         if is_header(row_idx):
-            values = self._column_names
-        else:
-            values = self._data[row_idx]
+            return self._format_row(self._column_names, underline=True)
+        return self._format_row(self._data[row_idx])
 
-        # formatted_columns is a list[list[str]] in which each element is a value that has been formatted according to self._col_format
-        formatted_columns = []
-        for val, width, fmt in zip(values, self.column_widths, self._format_spec):
-            value = [val]
+    def render(self, start: int = 0, stop: int = None, line_sep: str = "\n") -> list[str]:
+        """Formats rows start through stop - 1 of data a column at a time, and returns one string per row: the lines of that row joined by line_sep.
+
+        The string for row x is line_sep.join(a_table[x]), but formatting a whole column at once avoids most of the per-cell work of lines_for_row, which makes render much faster for many rows.
+
+        Parameters:
+            start:
+                The index of the first row to format. Default is the first row.
+            stop:
+                The index after the last row to format. Default is len(a_table).
+            line_sep:
+                The string between the lines of a row. Default is a newline.
+        """
+
+        rows = [self._data[row_idx] for row_idx in range(*slice(start, stop).indices(len(self)))]
+        if not rows:
+            return []
+
+        column_widths = self.column_widths
+
+        # cells[col_idx] is a list with the lines of each value in that column, formatted according to self._format_spec
+        cells = []
+        for column, width, fmt in zip(zip(*rows), column_widths, self._format_spec):
             match fmt:
                 case FormatSpec.PREFORMATTED:
-                    value = val.split(self._preformat_sep)
+                    cells.append([val.split(self._preformat_sep) for val in column])
                 case FormatSpec.WRAPPED:
-                    value = textwrap.wrap(str(val), width)
+                    cells.append([self._wrap_value(str(val), width) for val in column])
                 case FormatSpec.TRUNCATED:
-                    if len(val) > width:
-                        value = [
-                            f"{val[:(width-len(self._dots))]}{self._dots}"]
-            formatted_columns.append(value)
-
-        # Square off and transpose formatted_columns so each line has one value from each column
-        row = [self._col_sep.join(f"{v:<{w}}"
-                                  for (v, w) in zip(line, self.column_widths))
-               for line in itertools.zip_longest(*formatted_columns, fillvalue="")]
-
-        if is_header(row_idx):
-            underline = self._col_sep.join(
-                (self._head_underline*w for w in self.column_widths))
-            row.append(underline)
-
-        return row
+                    cells.append([[val] if len(val) <= width else
+                                  [f"{val[:(width-len(self._dots))]}{self._dots}"]
+                                  for val in column])
+
+        # The number of lines of each row
+        heights = list(map(max, itertools.repeat(0, len(rows)),
+                           *(map(len, column) for column in cells)))
+
+        # Square off each column into one list of lines for all rows, so that line i of every column belongs to the same line of the table
+        single_lines = all(height == 1 for height in heights)
+        if single_lines:
+            columns = [[value[0] if value else "" for value in column] for column in cells]
+        else:
+            columns = []
+            for column in cells:
+                lines = []
+                for value, height in zip(column, heights):
+                    lines.extend(value)
+                    lines.extend(itertools.repeat("", height - len(value)))
+                columns.append(lines)
+
+        # Pad every column to its width, then join the columns of each line
+        lines = list(map(self._col_sep.join,
+                         zip(*(map(str.ljust, column, itertools.repeat(width))
+                               for column, width in zip(columns, column_widths)))))
+
+        if single_lines:
+            return lines
+        rendered = []
+        first_line = 0
+        for height in heights:
+            rendered.append(line_sep.join(lines[first_line:first_line + height]))
+            first_line += height
+        return rendered
 
     def headers(self) -> list[str]:
         """Returns list of two strings containing headers and the underline for this Table."""
@@ -219,11 +265,14 @@ class Table:
             * The reamaining lines of the table are the rows of data, each value formatted according to the formatspec string (described below). Note that this means some rows of data will span multiple lines in the returned string.
         """
 
-        lines = self.headers()
-        for row in self:
-            lines.extend(row)
+        return "\n".join(self.lines())
 
-        return "\n".join(lines)
+    def lines(self) -> Iterator[str]:
+        """Yields the lines of str(self) one at a time: the header and its underline, then the lines of each row of data."""
+
+        yield from self.headers()
+        for row in self:
+            yield from row
 
     def __len__(self):
         """Returns the number of data rows in this table."""
@@ -231,102 +280,212 @@ class Table:
         return len(self._data)
 
     def __iter__(self):
-        """Returns an iterator for formatted rows of data in this table (does not include the header row).
+        """Yields the formatted rows of data in this table (does not include the header row).
         """
 
-        self._iter_cnt = 0
-        return self
-
-    def __next__(self):
-        """Returns the next row of data in this table as a formatted row."""
-
-        if self._iter_cnt == len(self):
-            raise StopIteration
-        next_row = self[self._iter_cnt]
-        self._iter_cnt += 1
-        return next_row
+        for row_idx in range(len(self)):
+            yield self[row_idx]
 
 # **************************************
 # *           BEGIN PRIVATE            *
 # **************************************
 
-    def _total_width(self) -> int:
-        """Computes and returns the total width of the table."""
+    def _format_row(self, values: list[str], underline: bool = False) -> list[str]:
+        """Generates the lines of text needed to print a row with the given values, followed by the header underline if underline is true."""
 
-        width = sum(self.column_widths) + \
-            (len(self._col_sep) * (len(self.column_widths)-1))
+        # formatted_columns is a list[list[str]] in which each element is a value that has been formatted according to self._col_format
+        column_widths = self.column_widths
+        formatted_columns = []
+        for val, width, fmt in zip(values, column_widths, self._format_spec):
+            value = [val]
+            match fmt:
+                case FormatSpec.PREFORMATTED:
+                    value = val.split(self._preformat_sep)
+                case FormatSpec.WRAPPED:
+                    value = self._wrap_value(str(val), width)
+                case FormatSpec.TRUNCATED:
+                    if len(val) > width:
+                        value = [
+                            f"{val[:(width-len(self._dots))]}{self._dots}"]
+            formatted_columns.append(value)
+
+        # Square off and transpose formatted_columns so each line has one value from each column
+        row = [self._col_sep.join(f"{v:<{w}}"
+                                  for (v, w) in zip(line, column_widths))
+               for line in itertools.zip_longest(*formatted_columns, fillvalue="")]
+
+        if underline:
+            row.append(self._col_sep.join(
+                (self._head_underline*w for w in column_widths)))
+
+        return row
+
+    def _wrap_value(self, text: str, width: int) -> tuple[str, ...]:
+        """Wraps the value of a WRAPPED column to its width."""
+
+        return _wrap(text, width)
+
+    def _nominal_widths(self) -> list[int]:
+        """Computes the width of each column in one pass over the data: the length of its longest value (header included), or of the longest line of its values if it is PREFORMATTED."""
+
+        # A PREFORMATTED column needs special treatment. A PREFORMATTED column actually contains several lines before any wrapping functions are applied; we want the longest of those lines.
+        def preformatted_width(value) -> int:
+            return max(len(line) for line in value.split(self._preformat_sep))
+
+        def width(value) -> int:
+            return len(str(value))
+
+        measures = [preformatted_width if fmt == FormatSpec.PREFORMATTED else width
+                    for fmt in self._format_spec]
+
+        widths = [measure(name) for measure, name in zip(measures, self._column_names)]
+        for row in self._data:
+            widths = [max(col_width, measure(value))
+                      for col_width, measure, value in zip(widths, measures, row)]
+
+        return widths
+
+    def _total_width(self, column_widths: list[int]) -> int:
+        """Computes and returns the total width of a table with the given column widths."""
+
+        width = sum(column_widths) + \
+            (len(self._col_sep) * (len(column_widths)-1))
         return width
 
-    def _redistribute_widths(self):
+    def _min_width(self, idx: int, nominal_widths: list[int]) -> int:
+        """Returns the narrowest width at which column idx is still "wide enough".
+
+        That is, the column must be at least as wide as:
+            * any line of its contents (aka its nominal width), if it is PREFORMATTED, or
+            * its header, if it is WRAPPED, or
+            * the wider of its header or len(_dots) + 3 characters, if it is TRUNCATED.
+        """
+
+        match self._format_spec[idx]:
+            case FormatSpec.WRAPPED:
+                return len(self._column_names[idx])
+            case FormatSpec.PREFORMATTED:
+                return nominal_widths[idx]
+            case FormatSpec.TRUNCATED:
+                return max(len(self._column_names[idx]), len(self._dots) + 3)
+
+        # This code should never be reached; here only to make pylint happy
+        assert False
+
+    def _redistribute_widths(self, nominal_widths: list[int]) -> list[int]:
         """Redistributes the column widths according to the algorithm described in column_widths.
+
+        Each character moves from the widest column that is still wide enough (the leftmost one among equally wide columns) to the last column, until the last column is wide enough. A heap keeps the columns that are wide enough ordered by width, so every character moved costs O(log(columns)).
         """
 
         # Truncate the rightmost column naively
-        redistributed_widths = list(self._column_widths)
+        redistributed_widths = list(nominal_widths)
         redistributed_widths[-1] = min(
             redistributed_widths[-1],
             self._max_width
-            - (self._total_width() - redistributed_widths[-1])
+            - (self._total_width(nominal_widths) - redistributed_widths[-1])
             - (len(self._col_sep) - 1))
 
-        # Helper function for REDISRIBUTE algorithm
-        def column_is_wide_enough(
-                width: int, header: str, format_spec: FormatSpec, nominal_width: int) -> bool:
-            """Returns true iff this column is "wide enough".
+        # Characters the last column is missing
+        missing = self._min_width(len(redistributed_widths) - 1, nominal_widths) - \
+            redistributed_widths[-1]
+        if missing <= 0:
+            return redistributed_widths
 
-            That is, returns True iff the column is at least as wide as:
-                * any line of its contents (aka nominal_width), if it is PREFORMATTED, or
-                * its header, if it is WRAPPED, or
-                * the wider of its header or len(_dots) + 3 characters, if it is TRUNCATED.
-            """
+        # Columns that can give up characters, widest first; the last column cannot while it is missing characters
+        reducable = [(-width, idx) for idx, width in enumerate(redistributed_widths[:-1])
+                     if width >= self._min_width(idx, nominal_widths)]
+        heapify(reducable)
 
-            match format_spec:
-                case FormatSpec.WRAPPED:
-                    return width >= len(header)
-                case FormatSpec.PREFORMATTED:
-                    return width >= nominal_width
-                case FormatSpec.TRUNCATED:
-                    return width >= max(len(header), len(self._dots + 3))
-
-            # This code should never be reached; here only to make pylint happy
-            assert False
-
-        # Helper function for REDISRIBUTE algorithm
-        def next_reducable_column_idx(widths: list[int]) -> int:
-            """Returns the index of the widest column that is wider than its header, or -1 if no such column exists.
-            """
-
-            # Sort the widths in decreasing order, keeping track of their original indices
-            sorted_idxes_and_widths = sorted(
-                enumerate(widths), key=lambda t: t[1], reverse=True)
-
-            idx = -1
-
-            # Sweep the widths from highest to lowest, stopping when there is a column that is wide
-            # enough to be reducable.
-            for i, width in sorted_idxes_and_widths:
-                if column_is_wide_enough(
-                        width,
-                        self._column_names[i],
-                        self._format_spec[i],
-                        self._column_widths[i]):
-                    idx = i
-                    break
-
-            return idx
-
-        # Helper function for REDISTRIBUTE algorithm
-        def last(itr) -> int:
-            return itr[-1]
-
-        # Loop for REDISTRIBUTE algorithm.
-        while (to_reduce := next_reducable_column_idx(redistributed_widths)) >= 0 and\
-                not column_is_wide_enough(
-                    last(redistributed_widths),
-                    last(self._column_names),
-                    last(self._format_spec),
-                    last(self._column_widths)):
+        while missing > 0 and reducable:
+            _, to_reduce = heappop(reducable)
             redistributed_widths[to_reduce] -= 1
             redistributed_widths[-1] += 1
+            missing -= 1
+            if redistributed_widths[to_reduce] >= self._min_width(to_reduce, nominal_widths):
+                heappush(reducable, (-redistributed_widths[to_reduce], to_reduce))
 
         return redistributed_widths
+
+
+class StreamingTable(Table):
+    """Class for formatting rows in an ASCII table while they are read from an iterable (for example, a sqlite3 cursor), so that the rows are never all in memory at once.
+
+    A StreamingTable differs from a Table in that:
+        * its column widths cannot depend on rows that have not been read yet. They are either given explicitly, or computed from the first sample_size rows; a later value that is wider than its column is wrapped or truncated as usual (or, if it is PREFORMATTED, sticks out of its column).
+        * it can be iterated only once, and it cannot be indexed (except for the headers) or measured with len. To print a large table, use:
+            for line in a_streaming_table.lines():
+                print(line)
+    """
+
+    # Default number of rows read to compute the column widths; can be overridden at init-time.
+    _SAMPLE_SIZE = 100
+
+    def __init__(self, column_names: list[str], rows: Iterable[list[str]], *,
+                 column_widths: list[int] = None,
+                 sample_size: int = None,
+                 **kwargs) -> None:
+        """Initializer for StreamingTable class.
+
+        Required positional parameters:
+            column_names:
+                A list of strings to use as column headers in the table.
+            rows:
+                An iterable of rows, each of which is a list of strings with the same length as column_names.
+
+        Optional keyword parameters:
+            column_widths:
+                The width of each column. Default computes the widths from the first sample_size rows.
+            sample_size:
+                The number of rows to compute the column widths from, if column_widths is not given. Default is _SAMPLE_SIZE.
+            Every other keyword parameter of Table.
+        """
+
+        assert (not column_widths) or (len(column_widths) == len(column_names)),\
+            "column_widths must have the same length as column_names."
+        assert (not sample_size) or (sample_size > 0),\
+            "sample_size must be positive."
+
+        self._rows = iter(rows)
+        if column_widths:
+            sample = []
+        else:
+            sample = list(itertools.islice(
+                self._rows, sample_size or StreamingTable._SAMPLE_SIZE))
+
+        super().__init__(column_names, sample, **kwargs)
+
+        if column_widths:
+            self.column_widths = list(column_widths)
+
+    def __getitem__(self, row_idx: int) -> str:
+        """Enables the use of accessor syntax ([...]) for the headers only; the rows of a StreamingTable are only available by iterating through it."""
+
+        if row_idx >= 0:
+            raise TypeError("The rows of a StreamingTable can only be iterated through.")
+        return self.lines_for_row(row_idx)
+
+    def __len__(self):
+        """Raises TypeError: the number of rows is not known until they have all been read."""
+
+        raise TypeError("A StreamingTable has no len().")
+
+    def __iter__(self):
+        """Yields the formatted rows of data in this table (does not include the header row), reading each row from the iterable only when it is needed."""
+
+        # The first iteration takes every row, so that another one (for instance on another thread) finds none rather than some of them
+        # The sample rows are formatted first, then dropped so they can be garbage collected; the column widths are computed from them before they are dropped (here rather than through column_widths, which takes the lock)
+        with self._lock:
+            if not self._column_widths:
+                self._column_widths = self._redistribute_widths(self._nominal_widths())
+            sample, rows = self._data, self._rows
+            self._data, self._rows = [], iter(())
+        for values in itertools.chain(sample, rows):
+            assert len(values) == len(self._column_names),\
+                "Each row in data must have the same length as the number of column headers."
+            yield self._format_row(values)
+
+    def _wrap_value(self, text: str, width: int) -> list[str]:
+        """Wraps the value of a WRAPPED column to its width, without memoizing it: each row is formatted only once, so its values would only crowd the cache."""
+
+        return textwrap.wrap(text, width)
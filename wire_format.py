@@ -0,0 +1,81 @@
+"""Module for the encodings of search responses that a client can ask the server for.
+
+"text" is the default: the response as LuxQuery builds it, rows as json arrays.
+"columnar" sends the rows as one json array per column ("data_columns" instead of "data"),
+which drops the brackets and separators of every row and groups the repetitive values of
+a column together, so that they compress better. Either encoding can be compressed with
+zlib, in which case the message travels as base64 text so the protocol stays line based.
+"""
+
+import base64
+import json
+import zlib
+
+ENCODINGS = ("text", "columnar")
+COMPRESSIONS = ("zlib",)
+
+# one encoder for every compact message: no whitespace, no circular reference check and
+# no escaping of non-ASCII characters (the socket encodes them as utf-8)
+_COMPACT_ENCODER = json.JSONEncoder(separators=(',', ':'), check_circular=False,
+                                    ensure_ascii=False)
+
+
+def check_encoding(encoding, compression):
+    """Raises ValueError for an encoding or compression the server does not support.
+
+    Args:
+        encoding (str): one of ENCODINGS, "text" if None
+        compression (str): one of COMPRESSIONS, or None
+    """
+
+    if encoding not in (None, *ENCODINGS):
+        raise ValueError(f"encoding must be one of {', '.join(ENCODINGS)}")
+    if compression not in (None, *COMPRESSIONS):
+        raise ValueError(f"compression must be one of {', '.join(COMPRESSIONS)}")
+
+
+def encode(message, encoding=None, compression=None):
+    """Serializes a search response or frame in the given encoding.
+
+    Args:
+        message (dict): response or frame, its rows (if any) in "data"
+        encoding (str): one of ENCODINGS, "text" if None
+        compression (str): one of COMPRESSIONS, or None
+
+    Return:
+        str: json, without a trailing newline
+    """
+
+    if encoding in (None, "text") and compression is None:
+        return json.dumps(message)
+
+    if encoding == "columnar" and "data" in message:
+        message = dict(message, encoding="columnar")
+        message["data_columns"] = list(zip(*message.pop("data")))
+
+    # only messages that carry rows are worth compressing
+    if compression is None or "data" not in message and "data_columns" not in message:
+        return _COMPACT_ENCODER.encode(message)
+
+    payload = zlib.compress(_COMPACT_ENCODER.encode(message).encode('utf-8'))
+    return json.dumps({"compression": compression,
+                       "payload": base64.b64encode(payload).decode('ascii')})
+
+
+def decode(message):
+    """Turns a message made by encode back into the text encoding.
+
+    Args:
+        message (dict): message read from the server
+
+    Return:
+        dict: the message with its rows in "data"
+    """
+
+    if message.get("compression") == "zlib":
+        message = json.loads(zlib.decompress(base64.b64decode(message["payload"])))
+
+    if message.pop("encoding", None) == "columnar":
+        message["data"] = [list(row) for row in zip(*message.pop("data_columns"))]
+
+    return message